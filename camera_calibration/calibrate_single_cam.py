@@ -2,8 +2,9 @@ import glob
 import os
 import cv2 as cv
 import numpy as np
+from corner_detection import detect_corners_cached, detect_corners_parallel, find_chessboard_corners, show_corners
 
-def calibrate_camera(images_folder, rows=9, columns=6, world_scaling=1.0):
+def calibrate_camera(images_folder, rows=9, columns=6, world_scaling=1.0, headless=False, processes=None, cache=None):
 
     """Calibrate a camera using a set of checkerboard calibration images.
 
@@ -17,6 +18,12 @@ def calibrate_camera(images_folder, rows=9, columns=6, world_scaling=1.0):
         columns (int, optional): The number of internal corners in the checkerboard's column. Default is 6.
         world_scaling (float, optional): A scaling factor to apply to the world coordinates of the checkerboard.
             Default is 1.0.
+        headless (bool, optional): Detect the corners of all images across a process pool without showing them.
+            The detected corner sets are the same as in the interactive mode. Default is False.
+        processes (int, optional): Number of worker processes in headless mode, None uses every core.
+        cache (CornerCache, optional): Corners of images that were already searched are read from this cache, new
+            images are detected across a process pool and added to it. Unless headless, the found corners are
+            still shown. Default is None.
 
     Returns:
         tuple: A tuple containing the camera matrix (mtx) and distortion coefficients (dist) as NumPy arrays for the specific camera.
@@ -37,16 +44,32 @@ def calibrate_camera(images_folder, rows=9, columns=6, world_scaling=1.0):
 
     #images_names = sorted(glob.glob(images_folder))
     images_names = sorted(glob.glob(os.path.join(images_folder, "*.png")))
-    images = []
-    for imname in images_names:
-        im = cv.imread(imname, 1)
-        images.append(im)
 
     # coordinates of squares in the checkerboard world space
     objp = np.zeros((rows * columns, 3), np.float32)
     objp[:, :2] = np.mgrid[0:rows, 0:columns].T.reshape(-1, 2)
     objp = world_scaling * objp
 
+    if cache is not None or headless:
+        if cache is not None:
+            detections = detect_corners_cached(images_names, cache, rows, columns, criteria, processes=processes)
+        else:
+            detections = detect_corners_parallel(images_names, rows, columns, criteria, processes=processes)
+        if not headless:
+            for imname, (corners, image_size) in zip(images_names, detections):
+                if corners is not None:
+                    show_corners(imname, corners, rows, columns)
+                    k = cv.waitKey(500)
+        imgpoints = [corners for corners, image_size in detections if corners is not None]
+        objpoints = [objp] * len(imgpoints)
+        width, height = detections[0][1]
+        return _calibrate(objpoints, imgpoints, width, height)
+
+    images = []
+    for imname in images_names:
+        im = cv.imread(imname, 1)
+        images.append(im)
+
     # frame dimensions. Frames should be the same size.
     width = images[0].shape[1]
     height = images[0].shape[0]
@@ -54,14 +77,14 @@ def calibrate_camera(images_folder, rows=9, columns=6, world_scaling=1.0):
     for frame in images:
         gray = cv.cvtColor(frame, cv.COLOR_BGR2GRAY)
 
-        # find the checkerboard
-        ret, corners = cv.findChessboardCorners(gray, (rows, columns), None)
+        # find the checkerboard, pre-screened on a downscaled image
+        ret, corners = find_chessboard_corners(gray, rows, columns)
 
         if ret:
             # Convolution size used to improve corner detection. Don't make this too large.
             conv_size = (11, 11)
 
-            # opencv can attempt to improve the checkerboard coordinates
+            # opencv can attempt to improve the checkerboard coordinates, at full resolution
             corners = cv.cornerSubPix(gray, corners, conv_size, (-1, -1), criteria)
             cv.drawChessboardCorners(frame, (rows, columns), corners, ret)
             cv.imshow('img', frame)
@@ -70,6 +93,10 @@ def calibrate_camera(images_folder, rows=9, columns=6, world_scaling=1.0):
             objpoints.append(objp)
             imgpoints.append(corners)
 
+    return _calibrate(objpoints, imgpoints, width, height)
+
+
+def _calibrate(objpoints, imgpoints, width, height):
     ret, mtx, dist, rvecs, tvecs = cv.calibrateCamera(objpoints, imgpoints, (width, height), None, None)
     print('Rmse:', ret)
     print('Camera Matrix:\n', mtx)
@@ -0,0 +1,258 @@
+import hashlib
+import json
+import os
+import sqlite3
+from concurrent.futures import ProcessPoolExecutor
+import cv2 as cv
+import numpy as np
+
+
+# longer side of the image the checkerboard is searched on, None searches the full resolution image
+PRESCREEN_SIZE = 640
+
+
+def find_chessboard_corners(gray, rows=9, columns=6, prescreen_size=PRESCREEN_SIZE, fallback=True):
+
+    """Search the checkerboard on a downscaled copy of a grayscale image.
+
+    The small image is searched with CALIB_CB_FAST_CHECK, which rejects frames without a board almost
+    instantly instead of running the full search. Found corners are scaled back to full resolution pixels,
+    so they only need to be refined with cornerSubPix on the full resolution image. The fast check also rejects
+    boards that look small after downscaling, so those are searched on the full resolution image (still with the
+    fast check) unless fallback is False.
+
+    Returns:
+        tuple: (ret, corners) like cv.findChessboardCorners, corners in full resolution pixels.
+    """
+
+    flags = cv.CALIB_CB_ADAPTIVE_THRESH + cv.CALIB_CB_NORMALIZE_IMAGE + cv.CALIB_CB_FAST_CHECK
+    if prescreen_size is not None and max(gray.shape) > prescreen_size:
+        scale = prescreen_size / max(gray.shape)
+        small = cv.resize(gray, None, fx=scale, fy=scale, interpolation=cv.INTER_AREA)
+        ret, corners = cv.findChessboardCorners(small, (rows, columns), flags=flags)
+        if ret:
+            # pixel centers of the small image back to the full resolution image
+            return True, (corners + 0.5) / scale - 0.5
+        if not fallback:
+            return False, None
+
+    # OpenCV does not tell whether the fast check or the search failed, so the full resolution search
+    # keeps the fast check to reject frames without a board
+    ret, corners = cv.findChessboardCorners(gray, (rows, columns), flags=flags)
+    return (True, corners) if ret else (False, None)
+
+
+def show_corners(image_path, corners, rows=9, columns=6, window='img'):
+
+    """Draw detected checkerboard corners on a calibration image and show it, like the interactive calibration does."""
+
+    frame = cv.imread(image_path, 1)
+    cv.drawChessboardCorners(frame, (rows, columns), corners, True)
+    cv.imshow(window, frame)
+
+
+def _find_and_refine(image_path, rows, columns, criteria, conv_size, raw_corners=None):
+    # returns (unrefined corners, refined corners, image size). With raw_corners of an earlier search
+    # the expensive findChessboardCorners is skipped and only cornerSubPix runs
+    if criteria is None:
+        criteria = (cv.TERM_CRITERIA_EPS + cv.TERM_CRITERIA_MAX_ITER, 30, 0.001)
+
+    # read in color and convert like the interactive path, so both give the same corners
+    frame = cv.imread(image_path, 1)
+    gray = cv.cvtColor(frame, cv.COLOR_BGR2GRAY)
+    image_size = (gray.shape[1], gray.shape[0])
+
+    if raw_corners is None:
+        ret, raw_corners = find_chessboard_corners(gray, rows, columns)
+        if not ret:
+            return None, None, image_size
+
+    # cornerSubPix refines in place
+    corners = cv.cornerSubPix(gray, raw_corners.copy(), conv_size, (-1, -1), criteria)
+    return raw_corners, corners, image_size
+
+
+def detect_corners(image_path, rows=9, columns=6, criteria=None, conv_size=(11, 11)):
+
+    """Detect and refine the checkerboard corners of one calibration image, without any GUI calls.
+
+    Args:
+        image_path (str): path of the calibration image.
+        rows (int, optional): The number of internal corners in the checkerboard's row. Default is 9.
+        columns (int, optional): The number of internal corners in the checkerboard's column. Default is 6.
+        criteria (tuple, optional): termination criteria of cornerSubPix.
+        conv_size (tuple, optional): search window of cornerSubPix. Default is (11, 11).
+
+    Returns:
+        tuple: (corners, image_size). corners is the refined (rows * columns, 1, 2) array, or None if
+        the checkerboard was not found. image_size is (width, height).
+    """
+
+    raw_corners, corners, image_size = _find_and_refine(image_path, rows, columns, criteria, conv_size)
+    return corners, image_size
+
+
+def _chunksize(num_tasks, processes):
+    # a few chunks per worker keeps the pool busy without sending every image path on its own
+    return max(1, num_tasks // (4 * (processes or os.cpu_count() or 1)))
+
+
+def _detect_corner_pair(image_paths, rows, columns, criteria, conv_size):
+    corners1, image_size = detect_corners(image_paths[0], rows, columns, criteria, conv_size)
+    if corners1 is None:
+        # no need to look at the second view
+        return None, None, image_size
+    corners2, _ = detect_corners(image_paths[1], rows, columns, criteria, conv_size)
+    return corners1, corners2, image_size
+
+
+def detect_corners_parallel(image_paths, rows=9, columns=6, criteria=None, conv_size=(11, 11), processes=None):
+
+    """Detect the checkerboard corners of many images across a process pool.
+
+    Returns:
+        list: (corners, image_size) of every image, in the order of image_paths.
+    """
+
+    image_paths = list(image_paths)
+    n = len(image_paths)
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        return list(executor.map(detect_corners, image_paths, [rows] * n, [columns] * n, [criteria] * n, [conv_size] * n,
+                                 chunksize=_chunksize(n, processes)))
+
+
+def detect_corner_pairs_parallel(image_pairs, rows=9, columns=6, criteria=None, conv_size=(11, 11), processes=None):
+
+    """Detect the checkerboard corners of image pairs across a process pool, one pair per task.
+
+    Returns:
+        list: (corners1, corners2, image_size) of every pair, in the order of image_pairs. Both corners are None
+        unless the checkerboard was found in the first image, corners2 is None if it was not found in the second one.
+    """
+
+    image_pairs = list(image_pairs)
+    n = len(image_pairs)
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        return list(executor.map(_detect_corner_pair, image_pairs, [rows] * n, [columns] * n, [criteria] * n, [conv_size] * n,
+                                 chunksize=_chunksize(n, processes)))
+
+
+def file_hash(path):
+
+    """sha1 of the content of a file, so copies of a calibration image (e.g. in the cam_ and paired_ folders) share one key."""
+
+    digest = hashlib.sha1()
+    with open(path, 'rb') as fin:
+        for block in iter(lambda: fin.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class CornerCache:
+
+    """Persistent cache of detected checkerboard corners, keyed by image content, board size and refinement settings.
+
+    Every calibration image is only searched once: intrinsic calibration, every stereo pair sharing the image
+    and later reruns read the corners from the cache. Two entries are kept per image: the result of the board
+    search (keyed by the board size only, also stored if no board was found) and the refined corners (keyed by
+    the cornerSubPix settings as well), so a different refinement only reruns the cheap cornerSubPix step.
+    The cache is a small sqlite database.
+
+    Example:
+        cache = CornerCache('calibration_frames/corners.sqlite')
+        mtx0, dist0 = calibrate_camera('calibration_frames/cam_0', cache=cache)
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._connection = sqlite3.connect(path)
+        with self._connection:
+            self._connection.execute('CREATE TABLE IF NOT EXISTS corners ('
+                                     'image TEXT NOT NULL, settings TEXT NOT NULL, found INTEGER NOT NULL, '
+                                     'corners BLOB NOT NULL, width INTEGER NOT NULL, height INTEGER NOT NULL, '
+                                     'PRIMARY KEY (image, settings))')
+
+    @staticmethod
+    def settings_key(rows, columns, criteria=None, conv_size=None):
+        # without criteria and conv_size the key of the unrefined board search
+        key = {'board': [rows, columns], 'prescreen_size': PRESCREEN_SIZE, 'fallback': True, 'fast_check': True}
+        if conv_size is not None:
+            key['criteria'] = list(criteria) if criteria is not None else None
+            key['conv_size'] = list(conv_size)
+        return json.dumps(key)
+
+    def get(self, image_key, settings):
+
+        """Cached (corners, image_size) of an image, None if the image was not processed with these settings yet."""
+
+        row = self._connection.execute('SELECT found, corners, width, height FROM corners WHERE image = ? AND settings = ?',
+                                       (image_key, settings)).fetchone()
+        if row is None:
+            return None
+        found, blob, width, height = row
+        corners = np.frombuffer(blob, dtype=np.float32).reshape((-1, 1, 2)).copy() if found else None
+        return corners, (width, height)
+
+    def put_many(self, entries):
+
+        """Store (image_key, settings, corners, image_size) entries in one transaction."""
+
+        rows = [(image_key, settings, corners is not None,
+                 b'' if corners is None else np.asarray(corners, dtype=np.float32).tobytes(), image_size[0], image_size[1])
+                for image_key, settings, corners, image_size in entries]
+        with self._connection:
+            self._connection.executemany('INSERT OR REPLACE INTO corners VALUES (?, ?, ?, ?, ?, ?)', rows)
+
+    def close(self):
+        self._connection.close()
+
+
+def detect_corners_cached(image_paths, cache, rows=9, columns=6, criteria=None, conv_size=(11, 11), processes=None):
+
+    """Like detect_corners_parallel, but images already in the CornerCache are not searched again.
+
+    Returns:
+        list: (corners, image_size) of every image, in the order of image_paths.
+    """
+
+    image_paths = list(image_paths)
+    search_key = cache.settings_key(rows, columns)
+    refined_key = cache.settings_key(rows, columns, criteria, conv_size)
+    image_keys = [file_hash(path) for path in image_paths]
+
+    results = {}
+    tasks = {}
+    for image_key, path in zip(image_keys, image_paths):
+        if image_key in results or image_key in tasks:
+            continue  # identical images are handled once
+        refined = cache.get(image_key, refined_key)
+        if refined is not None:
+            results[image_key] = refined
+            continue
+        searched = cache.get(image_key, search_key)
+        if searched is not None and searched[0] is None:
+            # known to show no board
+            results[image_key] = searched
+            continue
+        tasks[image_key] = (path, None if searched is None else searched[0])
+
+    cache.hits += len(results)
+    cache.misses += len(tasks)
+
+    if tasks:
+        n = len(tasks)
+        paths, raw_corners = zip(*tasks.values())
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            detections = list(executor.map(_find_and_refine, paths, [rows] * n, [columns] * n, [criteria] * n, [conv_size] * n,
+                                           raw_corners, chunksize=_chunksize(n, processes)))
+
+        entries = []
+        for image_key, (raw, corners, image_size) in zip(tasks, detections):
+            results[image_key] = (corners, image_size)
+            entries.append((image_key, search_key, raw, image_size))
+            entries.append((image_key, refined_key, corners, image_size))
+        cache.put_many(entries)
+
+    return [results[image_key] for image_key in image_keys]
@@ -0,0 +1,134 @@
+import cv2 as cv
+import numpy as np
+from corner_detection import find_chessboard_corners
+
+
+def board_features(corners, image_size, rows=9, columns=6, view=0, grid=(4, 3), tilt_threshold=0.1, size_bins=(0.2, 0.4)):
+
+    """Describe where and how a checkerboard appears in an image as a set of coverage features.
+
+    The features are the grid cells of the image the board's bounding box overlaps (image area), the
+    direction the board is tilted in (from the length ratio of its opposite edges) and its apparent size
+    (a proxy for its distance to the camera).
+
+    Args:
+        corners (numpy.ndarray): (rows * columns, 1, 2) corners from findChessboardCorners.
+        image_size (tuple): (width, height) of the image.
+        rows (int, optional): The number of internal corners in the checkerboard's row. Default is 9.
+        columns (int, optional): The number of internal corners in the checkerboard's column. Default is 6.
+        view (int, optional): camera view the features belong to, so both views of a pair add their own features.
+        grid (tuple, optional): number of (horizontal, vertical) image cells. Default is (4, 3).
+        tilt_threshold (float, optional): log edge length ratio above which the board counts as tilted. Default is 0.1.
+        size_bins (tuple, optional): bin edges of the board size relative to the image size. Default is (0.2, 0.4).
+
+    Returns:
+        set: hashable features, e.g. ('cell', 0, 1, 2), ('tilt', 0, -1, 0), ('size', 0, 1).
+    """
+
+    width, height = image_size
+    points = corners.reshape((columns, rows, 2))
+    features = set()
+
+    # image area: grid cells overlapped by the bounding box of the board
+    (x0, y0), (x1, y1) = points.reshape((-1, 2)).min(axis=0), points.reshape((-1, 2)).max(axis=0)
+    for gx in range(int(x0 * grid[0] / width), min(int(x1 * grid[0] / width), grid[0] - 1) + 1):
+        for gy in range(int(y0 * grid[1] / height), min(int(y1 * grid[1] / height), grid[1] - 1) + 1):
+            features.add(('cell', view, gx, gy))
+
+    # tilt: an edge further away from the camera appears shorter
+    top = np.linalg.norm(points[0, -1] - points[0, 0])
+    bottom = np.linalg.norm(points[-1, -1] - points[-1, 0])
+    left = np.linalg.norm(points[-1, 0] - points[0, 0])
+    right = np.linalg.norm(points[-1, -1] - points[0, -1])
+    tilt_h = np.log(left / right)
+    tilt_v = np.log(top / bottom)
+    features.add(('tilt', view, int(np.sign(tilt_h)) if abs(tilt_h) > tilt_threshold else 0,
+                  int(np.sign(tilt_v)) if abs(tilt_v) > tilt_threshold else 0))
+
+    # distance: apparent size of the board
+    outline = np.array([points[0, 0], points[0, -1], points[-1, -1], points[-1, 0]], dtype=np.float32)
+    size = np.sqrt(cv.contourArea(outline) / (width * height))
+    features.add(('size', view, int(np.searchsorted(size_bins, size))))
+    return features
+
+
+def scan_calibration_videos(video1_path, video2_path, stride_seconds=0.5, rows=9, columns=6):
+
+    """Walk two synchronized calibration videos and find the frames that show the board in both views.
+
+    The videos are read forward once, every frame is grabbed but only one frame every stride_seconds is decoded
+    and checked with the fast, downscaled chessboard search (falling back to the full resolution fast check, see
+    find_chessboard_corners).
+
+    Returns:
+        list: (second, features) of every frame with a board in both views, features as in board_features.
+    """
+
+    video1 = cv.VideoCapture(video1_path)
+    video2 = cv.VideoCapture(video2_path)
+    fps = video1.get(cv.CAP_PROP_FPS) or 30.0
+    step = max(1, int(round(stride_seconds * fps)))
+
+    candidates = []
+    frame_index = 0
+    while video1.grab() and video2.grab():
+        if frame_index % step == 0:
+            _, frame1 = video1.retrieve()
+            _, frame2 = video2.retrieve()
+            gray1 = cv.cvtColor(frame1, cv.COLOR_BGR2GRAY)
+            ret1, corners1 = find_chessboard_corners(gray1, rows, columns)
+            if ret1:
+                gray2 = cv.cvtColor(frame2, cv.COLOR_BGR2GRAY)
+                ret2, corners2 = find_chessboard_corners(gray2, rows, columns)
+                if ret2:
+                    features = board_features(corners1, gray1.shape[::-1], rows, columns, view=0)
+                    features |= board_features(corners2, gray2.shape[::-1], rows, columns, view=1)
+                    candidates.append((round(frame_index / fps, 3), features))
+        frame_index += 1
+
+    video1.release()
+    video2.release()
+    return candidates
+
+
+def select_frames(candidates, max_frames=20):
+
+    """Greedily pick up to max_frames candidates that together cover the most board features.
+
+    Each step takes the candidate adding the most features not covered yet. Once nothing new can be covered,
+    coverage starts over, so the remaining picks spread over the features again instead of piling up.
+
+    Returns:
+        list: the seconds of the selected frames, in time order.
+    """
+
+    remaining = list(candidates)
+    selected = []
+    covered = set()
+    while remaining and len(selected) < max_frames:
+        gains = [len(features - covered) for second, features in remaining]
+        best = int(np.argmax(gains))
+        if gains[best] == 0:
+            if not covered:
+                break
+            covered = set()
+            continue
+        second, features = remaining.pop(best)
+        selected.append(second)
+        covered |= features
+    return sorted(selected)
+
+
+def select_calibration_frames(video1_path, video2_path, max_frames=20, stride_seconds=0.5, rows=9, columns=6):
+
+    """Capture seconds of a well spread set of calibration frames of a camera pair, replacing hand picked capture_seconds lists.
+
+    Example:
+        capture_seconds = select_calibration_frames('cam_0.mp4', 'cam_1.mp4', max_frames=20)
+        generate_calibration_frames('cam_0.mp4', 'cam_1.mp4', capture_seconds, 'calibration_frames/', view1=0, view2=1)
+    """
+
+    candidates = scan_calibration_videos(video1_path, video2_path, stride_seconds, rows, columns)
+    capture_seconds = select_frames(candidates, max_frames)
+    print(f'{len(candidates)} frames show the board in both views, selected {len(capture_seconds)}: {capture_seconds}')
+    return capture_seconds
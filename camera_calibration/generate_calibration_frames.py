@@ -1,5 +1,6 @@
 import cv2
 import os
+from concurrent.futures import ThreadPoolExecutor
 
 def generate_calibration_frames(video1_path, video2_path, capture_seconds, output_folder, view1 = 0, view2 = 1):
 
@@ -30,51 +31,95 @@ def generate_calibration_frames(video1_path, video2_path, capture_seconds, outpu
 
     """
 
-    # Load the videos
-    video1 = cv2.VideoCapture(video1_path)
-    video2 = cv2.VideoCapture(video2_path)
+    extract_calibration_frames({view1: video1_path, view2: video2_path}, {(view1, view2): capture_seconds}, output_folder)
 
-    # Create the output folder if it doesn't exist
-    if not os.path.exists(output_folder):
-        os.makedirs(output_folder)
 
-    # Create the output folders for each camera if they don't exist
-    cam1_folder = os.path.join(output_folder, f'cam_{view1}')
-    cam2_folder = os.path.join(output_folder, f'cam_{view2}')
-    paired_folder = os.path.join(output_folder, f'paired_cam{view1}_cam{view2}')
+def _extract_camera_frames(video_path, outputs):
+    # walks one video forward once: every frame is grabbed, only the requested ones are decoded.
+    # outputs maps a second to the image paths it is saved to, returns the seconds that were saved
+    video = cv2.VideoCapture(video_path)
+    fps = video.get(cv2.CAP_PROP_FPS) or 30.0
+    wanted = {}
+    for sec in outputs:
+        wanted.setdefault(int(round(sec * fps)), []).append(sec)
+    last_index = max(wanted, default=-1)
 
-    if not os.path.exists(cam1_folder):
-        os.makedirs(cam1_folder)
+    saved = set()
+    frame_index = 0
+    while frame_index <= last_index and video.grab():
+        if frame_index in wanted:
+            ret, frame = video.retrieve()
+            if ret:
+                # encode once, the same image goes to the camera folder and every paired folder
+                ok, png = cv2.imencode('.png', frame)
+                for sec in wanted[frame_index]:
+                    for path in outputs[sec]:
+                        with open(path, 'wb') as fout:
+                            fout.write(png.tobytes())
+                    saved.add(sec)
+        frame_index += 1
 
-    if not os.path.exists(cam2_folder):
-        os.makedirs(cam2_folder)
+    video.release()
+    return saved
 
-    if not os.path.exists(paired_folder):
-        os.makedirs(paired_folder)
 
-    # Capture frames at the desired seconds from both videos
-    for sec in capture_seconds:
-        # Set the video file positions to the desired second
-        video1.set(cv2.CAP_PROP_POS_MSEC, sec * 1000)
-        video2.set(cv2.CAP_PROP_POS_MSEC, sec * 1000)
+def extract_calibration_frames(video_paths, capture_seconds, output_folder, max_workers=None):
 
-        # Capture the frames
-        ret1, frame1 = video1.read()
-        ret2, frame2 = video2.read()
+    """Generate the calibration frames of all camera pairs with one forward pass over every video.
 
-        if ret1 and ret2:
-            # Save the frames to separate folders
-            cv2.imwrite(os.path.join(cam1_folder, f'cam_{view1}_at_{sec}.png'), frame1)
-            cv2.imwrite(os.path.join(cam2_folder, f'cam_{view2}_at_{sec}.png'), frame2)
+    Unlike seeking to every second of every pair, each camera video is opened once and walked forward with
+    grab(), only the frames needed by any pair are decoded with retrieve(). The cameras are processed in
+    parallel threads (decoding releases the GIL). Frames are saved like generate_calibration_frames does, a
+    second is only kept for a pair if it could be read from both videos.
 
-            # Save the frames to the paired folder
-            cv2.imwrite(os.path.join(paired_folder, f'cam_{view1}_at_{sec}.png'), frame1)
-            cv2.imwrite(os.path.join(paired_folder, f'cam_{view2}_at_{sec}.png'), frame2)
+    Args:
+        video_paths (dict): camera view -> path of its calibration video.
+        capture_seconds (dict): (view1, view2) pair -> list of seconds at which frames will be captured.
+        output_folder (str): The path to the output folder where this frames will be saved.
+        max_workers (int, optional): number of videos decoded at the same time. Default decodes all at once.
+
+    Returns:
+        None: The calibration frames are saved in the specified output_folder.
 
+    Example:
+        extract_calibration_frames({0: 'cam_0.mp4', 1: 'cam_1.mp4', 2: 'cam_2.mp4'},
+                                   {(0, 1): [5, 10, 15], (0, 2): [10, 20]}, 'output_folder/')
+        This decodes 'cam_0.mp4' once for both pairs and fills 'output_folder/cam_0/', 'output_folder/cam_1/',
+        'output_folder/cam_2/', 'output_folder/paired_cam0_cam1/' and 'output_folder/paired_cam0_cam2/'.
+    """
 
-    # Release the videos
-    video1.release()
-    video2.release()
+    # image paths every camera has to save, per second
+    outputs = {view: {} for view in video_paths}
+    for (view1, view2), seconds in capture_seconds.items():
+        paired_folder = os.path.join(output_folder, f'paired_cam{view1}_cam{view2}')
+        os.makedirs(paired_folder, exist_ok=True)
+        for view in (view1, view2):
+            cam_folder = os.path.join(output_folder, f'cam_{view}')
+            os.makedirs(cam_folder, exist_ok=True)
+            for sec in seconds:
+                paths = outputs[view].setdefault(sec, [os.path.join(cam_folder, f'cam_{view}_at_{sec}.png')])
+                paths.append(os.path.join(paired_folder, f'cam_{view}_at_{sec}.png'))
+
+    views = list(video_paths)
+    with ThreadPoolExecutor(max_workers=max_workers or len(views)) as executor:
+        saved = dict(zip(views, executor.map(_extract_camera_frames, [video_paths[view] for view in views],
+                                             [outputs[view] for view in views])))
+
+    # a second one of the videos could not be read is dropped from the pair, like the per pair seeking did
+    used = {view: set() for view in views}
+    for (view1, view2), seconds in capture_seconds.items():
+        for sec in seconds:
+            if sec in saved[view1] and sec in saved[view2]:
+                used[view1].add(sec)
+                used[view2].add(sec)
+                continue
+            for view in (view1, view2):
+                path = os.path.join(output_folder, f'paired_cam{view1}_cam{view2}', f'cam_{view}_at_{sec}.png')
+                if os.path.exists(path):
+                    os.remove(path)
+    for view in views:
+        for sec in saved[view] - used[view]:
+            os.remove(outputs[view][sec][0])
 
 #if __name__ == '__main__':
 # Example usage:
@@ -3,12 +3,14 @@ import os
 import numpy as np
 from split_videos import split_video
 from parse_write import load_config, save_camera_intrinsics, save_extrinsic_calibration_parameters
-from generate_calibration_frames import generate_calibration_frames
+from generate_calibration_frames import extract_calibration_frames
 from calibrate_single_cam import calibrate_camera
 from stereo_calibration import stereo_calibrate
+from corner_detection import CornerCache
+from frame_selection import select_calibration_frames
 
 
-def calibration(split_multiview, config_data) :
+def calibration(split_multiview, config_data, headless=False) :
 
     #load config data
     config = load_config(config_data)
@@ -22,31 +24,48 @@ def calibration(split_multiview, config_data) :
                     config['num_cams'])
         
     #assuming cam_0 is the reference
+    capture_seconds = {}
     for i in range (config['num_cams']-1):
-        
-        generate_calibration_frames(config[f'calibration_cam_{0}_path'], 
-                                    config[f'calibration_cam_{i+1}_path'], 
-                                    config[f'capture_seconds_cam{0}_cam{i+1}'], 
-                                    config['calibration_frames_output_folder'], 
-                                    view1=0, 
-                                    view2=i+1)
-
-    # calibrate each camera separately and save it to the intirnsic file 
+
+        # without a hand picked capture_seconds list (or with 'auto') the frames are selected from the videos
+        seconds = config.get(f'capture_seconds_cam{0}_cam{i+1}', 'auto')
+        if seconds == 'auto':
+            seconds = select_calibration_frames(config[f'calibration_cam_{0}_path'],
+                                                config[f'calibration_cam_{i+1}_path'],
+                                                max_frames=config.get('max_calibration_frames', 20),
+                                                stride_seconds=config.get('frame_selection_stride', 0.5))
+        capture_seconds[(0, i+1)] = seconds
+
+    # one forward pass over every camera video extracts the frames of all pairs
+    extract_calibration_frames({i: config[f'calibration_cam_{i}_path'] for i in range(config['num_cams'])},
+                               capture_seconds,
+                               config['calibration_frames_output_folder'])
+
+    # detected corners are cached per image content, so intrinsics, every stereo pair and reruns
+    # only search the frames they have not seen yet
+    cache_path = config.get('corner_cache_path', os.path.join(config['calibration_frames_output_folder'], 'corners.sqlite'))
+    cache = CornerCache(cache_path)
+
+    # calibrate each camera separately (once) and save it to the intirnsic file
+    intrinsics = []
+    for i in range (config['num_cams']):
+        path = os.path.join(config['calibration_frames_output_folder'], f'cam_{i}')
+        mtx, dist = calibrate_camera(images_folder = path, headless = headless, cache = cache)
+        save_camera_intrinsics(config['parameter_folder'], mtx, dist, f'cam_{i}')
+        intrinsics.append((mtx, dist))
+
     for i in range (config['num_cams']-1):
 
-        path1 = os.path.join(config['calibration_frames_output_folder'], f'cam_{0}')
-        path2 = os.path.join(config['calibration_frames_output_folder'], f'cam_{i+1}')
-        mtx1, dist1 = calibrate_camera(images_folder = path1)
-        mtx2, dist2 = calibrate_camera(images_folder = path2)
-    
-        save_camera_intrinsics(config['parameter_folder'], mtx1, dist1, f'cam_{0}')
-        save_camera_intrinsics(config['parameter_folder'], mtx2, dist2, f'cam_{i+1}')
-        
-        R_pair, T_pair = stereo_calibrate(mtx1, dist1, mtx2, dist2, os.path.join(config['calibration_frames_output_folder'], f'paired_cam{0}_cam{i+1}'))
+        mtx1, dist1 = intrinsics[0]
+        mtx2, dist2 = intrinsics[i+1]
+        R_pair, T_pair = stereo_calibrate(mtx1, dist1, mtx2, dist2, os.path.join(config['calibration_frames_output_folder'], f'paired_cam{0}_cam{i+1}'), headless = headless, cache = cache)
         save_extrinsic_calibration_parameters(config['parameter_folder'], R_pair, T_pair, cam1_name=f'cam_{i+1}', prefix='')
     #for cam 0 - reference 
     save_extrinsic_calibration_parameters(config['parameter_folder'], np.eye(3), [[0],[0],[0]], cam1_name=f'cam_{0}', prefix='')
 
+    print(f'corner cache: {cache.hits} images reused, {cache.misses} images detected')
+    cache.close()
+
 
 
 if __name__ == "__main__":
@@ -56,6 +75,7 @@ if __name__ == "__main__":
 
     # Add the arguments you want to accept
     parser.add_argument("--split_multiview", type=bool, default=False, help="If your initial video is multi view of the same scene, this helps us to split it to single view videos.")
+    parser.add_argument("--headless", action="store_true", help="Calibrate without showing the detected checkerboards.")
     parser.add_argument("--config_path", type=str, default="./config.yaml", help="Config data path which contains all relevant parameters for calibration")
 
     # Parse the command-line arguments
@@ -63,4 +83,4 @@ if __name__ == "__main__":
 
     
     # Call the function with the provided arguments
-    calibration(args.split_multiview, args.config_path)
+    calibration(args.split_multiview, args.config_path, args.headless)
@@ -2,9 +2,10 @@ import glob
 import os
 import cv2 as cv
 import numpy as np
+from corner_detection import detect_corner_pairs_parallel, detect_corners_cached, find_chessboard_corners, show_corners
 
 
-def stereo_calibrate(mtx1, dist1, mtx2, dist2, paired_frames_folder, rows=9, columns=6, world_scaling=1.0):
+def stereo_calibrate(mtx1, dist1, mtx2, dist2, paired_frames_folder, rows=9, columns=6, world_scaling=1.0, headless=False, processes=None, cache=None):
 
     """Perform stereo camera calibration using a set of paired checkerboard calibration images.
 
@@ -22,6 +23,12 @@ def stereo_calibrate(mtx1, dist1, mtx2, dist2, paired_frames_folder, rows=9, col
         columns (int, optional): The number of internal corners in the checkerboard's column. Default is 6.
         world_scaling (float, optional): A scaling factor to apply to the world coordinates of the checkerboard.
             Default is 1.0.
+        headless (bool, optional): Detect the corners of all image pairs across a process pool, one pair per task,
+            without showing them. The detected corner sets are the same as in the interactive mode. Default is False.
+        processes (int, optional): Number of worker processes in headless mode, None uses every core.
+        cache (CornerCache, optional): Corners of images that were already searched, e.g. by calibrate_camera,
+            are read from this cache, new images are detected across a process pool and added to it. Unless headless,
+            the found corners are still shown. Default is None.
 
     Returns:
         tuple: A tuple containing the rotation matrix (R) and translation vector (T) as NumPy arrays.
@@ -45,6 +52,35 @@ def stereo_calibrate(mtx1, dist1, mtx2, dist2, paired_frames_folder, rows=9, col
     c1_images_names = images_names[:len(images_names) // 2]
     c2_images_names = images_names[len(images_names) // 2:]
 
+    # Criteria for refining the corners (change this if stereo calibration not good)
+    criteria = (cv.TERM_CRITERIA_EPS + cv.TERM_CRITERIA_MAX_ITER, 100, 0.0001)
+
+    # coordinates of squares in the checkerboard world space
+    objp = np.zeros((rows * columns, 3), np.float32)
+    objp[:, :2] = np.mgrid[0:rows, 0:columns].T.reshape(-1, 2)
+    objp = world_scaling * objp
+
+    if cache is not None or headless:
+        if cache is not None:
+            # every image on its own, so corners found by the intrinsic calibration or other pairs are reused
+            num_pairs = min(len(c1_images_names), len(c2_images_names))
+            detections = detect_corners_cached(c1_images_names[:num_pairs] + c2_images_names[:num_pairs], cache, rows, columns, criteria, processes=processes)
+            detections = [(corners1, corners2, image_size) for (corners1, image_size), (corners2, _) in zip(detections[:num_pairs], detections[num_pairs:])]
+        else:
+            detections = detect_corner_pairs_parallel(zip(c1_images_names, c2_images_names), rows, columns, criteria, processes=processes)
+        pairs = [(corners1, corners2) for corners1, corners2, image_size in detections if corners1 is not None and corners2 is not None]
+        if not headless:
+            for im1, im2, (corners1, corners2, image_size) in zip(c1_images_names, c2_images_names, detections):
+                if corners1 is not None and corners2 is not None:
+                    show_corners(im1, corners1, rows, columns, 'img')
+                    show_corners(im2, corners2, rows, columns, 'img2')
+                    k = cv.waitKey(500)
+        imgpoints_left = [corners1 for corners1, corners2 in pairs]
+        imgpoints_right = [corners2 for corners1, corners2 in pairs]
+        objpoints = [objp] * len(pairs)
+        width, height = detections[0][2]
+        return _stereo_calibrate(objpoints, imgpoints_left, imgpoints_right, mtx1, dist1, mtx2, dist2, width, height, criteria)
+
     # Separate images for camera 1 and camera 2
     c1_images = []
     c2_images = []
@@ -55,14 +91,6 @@ def stereo_calibrate(mtx1, dist1, mtx2, dist2, paired_frames_folder, rows=9, col
         _im = cv.imread(im2, 1)
         c2_images.append(_im)
 
-    # Criteria for refining the corners (change this if stereo calibration not good)
-    criteria = (cv.TERM_CRITERIA_EPS + cv.TERM_CRITERIA_MAX_ITER, 100, 0.0001)
-
-    # coordinates of squares in the checkerboard world space
-    objp = np.zeros((rows * columns, 3), np.float32)
-    objp[:, :2] = np.mgrid[0:rows, 0:columns].T.reshape(-1, 2)
-    objp = world_scaling * objp
-
     # frame dimensions. Frames should be the same size.
     width = c1_images[0].shape[1]
     height = c1_images[0].shape[0]
@@ -78,8 +106,9 @@ def stereo_calibrate(mtx1, dist1, mtx2, dist2, paired_frames_folder, rows=9, col
     for frame1, frame2 in zip(c1_images, c2_images):
         gray1 = cv.cvtColor(frame1, cv.COLOR_BGR2GRAY)
         gray2 = cv.cvtColor(frame2, cv.COLOR_BGR2GRAY)
-        c_ret1, corners1 = cv.findChessboardCorners(gray1, (rows, columns), None)
-        c_ret2, corners2 = cv.findChessboardCorners(gray2, (rows, columns), None)
+        # pre-screened on downscaled images, refined at full resolution below
+        c_ret1, corners1 = find_chessboard_corners(gray1, rows, columns)
+        c_ret2, corners2 = find_chessboard_corners(gray2, rows, columns) if c_ret1 else (False, None)
 
         if c_ret1 and c_ret2:
             corners1 = cv.cornerSubPix(gray1, corners1, (11, 11), (-1, -1), criteria)
@@ -96,6 +125,10 @@ def stereo_calibrate(mtx1, dist1, mtx2, dist2, paired_frames_folder, rows=9, col
             imgpoints_left.append(corners1)
             imgpoints_right.append(corners2)
 
+    return _stereo_calibrate(objpoints, imgpoints_left, imgpoints_right, mtx1, dist1, mtx2, dist2, width, height, criteria)
+
+
+def _stereo_calibrate(objpoints, imgpoints_left, imgpoints_right, mtx1, dist1, mtx2, dist2, width, height, criteria):
     stereocalibration_flags = cv.CALIB_FIX_INTRINSIC
     ret, CM1, dist1, CM2, dist2, R, T, E, F = cv.stereoCalibrate(
         objpoints, imgpoints_left, imgpoints_right, mtx1, dist1,
@@ -0,0 +1,184 @@
+import queue
+import threading
+import cv2 as cv
+import numpy as np
+from utils import detect_keypoints, draw_keypoints
+
+
+class FrameBuffers:
+
+    """Preallocated BGR capture and RGB conversion buffers of one camera.
+
+    The buffers are allocated on the first frame and then reused, so the steady state frame path does
+    not allocate. size is the number of frames that can be in flight at once (1 when every frame is
+    consumed before the next read, more when frames are queued to another thread).
+    """
+
+    def __init__(self, size=1):
+        self.bgr = [None] * size
+        self.rgb = [None] * size
+        self.index = 0
+
+    def read(self, cap, convert=True):
+        # convert=False skips the RGB conversion, e.g. when an InferenceInput converts a smaller image
+        i = self.index
+        self.index = (i + 1) % len(self.bgr)
+
+        # cap.read and cvtColor write into the given arrays if their shape matches, otherwise they allocate once
+        ret, frame = cap.read(self.bgr[i])
+        if not ret:
+            return False, None, None
+        self.bgr[i] = frame
+        if not convert:
+            return True, frame, None
+        self.rgb[i] = cv.cvtColor(frame, cv.COLOR_BGR2RGB, dst=self.rgb[i])
+        return True, self.bgr[i], self.rgb[i]
+
+
+def process_camera_frame(cap, pose, pose_keypoints, headless=False, buffers=None, inference_input=None):
+
+    """Read one frame of a camera, run the pose model on it and extract the keypoints.
+
+    With an InferenceInput the pose model runs on a downscaled (and optionally cropped) image and the
+    keypoints are mapped back to full resolution pixels.
+
+    Returns:
+        tuple: (ret, frame, keypoints, valid). frame is the BGR capture buffer, with the keypoints drawn on it
+        unless running headless. keypoints is (K, 2) float32 and valid the (K,) detection mask.
+        ret is False once the stream ended.
+    """
+
+    if buffers is None:
+        buffers = FrameBuffers()
+
+    ret, frame, frame_rgb = buffers.read(cap, convert=inference_input is None)
+    if not ret:
+        return False, None, None, None
+    if inference_input is not None:
+        frame_rgb = inference_input.prepare(frame)
+
+    # Marking the RGB image as not writeable lets mediapipe take it by reference.
+    frame_rgb.flags.writeable = False
+    result = pose.process(frame_rgb)
+    frame_rgb.flags.writeable = True
+
+    # keypoints are drawn on the BGR capture buffer, so no conversion back is needed
+    if inference_input is None:
+        keypoints, visibility, valid = detect_keypoints(frame, result, pose_keypoints, draw=not headless)
+        return True, frame, keypoints, valid
+
+    keypoints, visibility, valid = detect_keypoints(frame_rgb, result, pose_keypoints, draw=False)
+    keypoints = inference_input.map_back(keypoints, valid)
+    if not headless:
+        draw_keypoints(frame, keypoints, valid)
+    return True, frame, keypoints, valid
+
+
+def read_frames_serial(caps, poses, pose_keypoints, headless=False, inference_inputs=None):
+
+    """Yield (frames, keypoints, valid) of every frame index, processing the cameras one after another.
+
+    keypoints is a (C, K, 2) array and valid the (C, K) detection mask of the frame.
+    inference_inputs optionally holds one InferenceInput per camera.
+    """
+
+    buffers = [FrameBuffers() for _ in caps]
+    if inference_inputs is None:
+        inference_inputs = [None] * len(caps)
+    while True:
+        frames = []
+        keypoints = []
+        valid = []
+        for cap, pose, cap_buffers, inference_input in zip(caps, poses, buffers, inference_inputs):
+            ret, frame, frame_keypoints, frame_valid = process_camera_frame(cap, pose, pose_keypoints, headless, cap_buffers, inference_input)
+            if not ret:
+                return  # End of video reached
+            frames.append(frame)
+            keypoints.append(frame_keypoints)
+            valid.append(frame_valid)
+
+        yield frames, np.stack(keypoints), np.stack(valid)
+
+
+class CameraWorker(threading.Thread):
+
+    """Background thread owning one camera: decode, color conversion, Pose.process and keypoint extraction.
+
+    Results are put into a bounded queue as (frame_index, frame, keypoints, valid) in frame order, followed by
+    None once the stream ended. OpenCV decoding and mediapipe inference release the GIL, so the workers
+    of different cameras run concurrently.
+    """
+
+    def __init__(self, cap, pose, pose_keypoints, headless=False, max_queue_size=4, inference_input=None):
+        super().__init__(daemon=True)
+        self.cap = cap
+        self.pose = pose
+        self.pose_keypoints = pose_keypoints
+        self.headless = headless
+        self.inference_input = inference_input
+        self.results = queue.Queue(maxsize=max_queue_size)
+        # frames in the queue, the one being gathered and the one being read must not share a buffer
+        self.buffers = FrameBuffers(size=max_queue_size + 2)
+        self._stop_event = threading.Event()
+
+    def run(self):
+        frame_index = 0
+        while not self._stop_event.is_set():
+            ret, frame, keypoints, valid = process_camera_frame(self.cap, self.pose, self.pose_keypoints, self.headless, self.buffers,
+                                                                  self.inference_input)
+            if not ret:
+                break
+            if not self._put((frame_index, frame, keypoints, valid)):
+                return
+            frame_index += 1
+        self._put(None)
+
+    def _put(self, item):
+        # bounded put that gives up once the worker is stopped, so a full queue never blocks shutdown
+        while not self._stop_event.is_set():
+            try:
+                self.results.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def stop(self):
+        self._stop_event.set()
+
+
+def read_frames_parallel(caps, poses, pose_keypoints, headless=False, max_queue_size=4, inference_inputs=None):
+
+    """Yield (frames, keypoints, valid) of every frame index, with one CameraWorker per camera.
+
+    The caller only gathers the per camera results of a frame index, so the frame time is close to
+    the slowest camera instead of the sum over all cameras.
+    """
+
+    if inference_inputs is None:
+        inference_inputs = [None] * len(caps)
+    workers = [CameraWorker(cap, pose, pose_keypoints, headless, max_queue_size, inference_input)
+               for cap, pose, inference_input in zip(caps, poses, inference_inputs)]
+    for worker in workers:
+        worker.start()
+
+    try:
+        while True:
+            frames = []
+            keypoints = []
+            valid = []
+            for worker in workers:
+                item = worker.results.get()
+                if item is None:
+                    return  # End of video reached
+                frame_index, frame, frame_keypoints, frame_valid = item
+                frames.append(frame)
+                keypoints.append(frame_keypoints)
+                valid.append(frame_valid)
+
+            yield frames, np.stack(keypoints), np.stack(valid)
+    finally:
+        for worker in workers:
+            worker.stop()
+        for worker in workers:
+            worker.join()
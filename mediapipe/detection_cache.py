@@ -0,0 +1,213 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+import numpy as np
+
+# number of mediapipe pose landmarks, each stored as x, y, z, visibility
+NUM_LANDMARKS = 33
+
+Landmark = namedtuple('Landmark', ['x', 'y', 'z', 'visibility'])
+
+
+class CachedLandmarks:
+    def __init__(self, landmarks):
+        self.landmark = [Landmark(*values) for values in landmarks.tolist()]
+
+
+class CachedResults:
+
+    """Stand-in for the output of Pose.process, built from cached landmarks (None if nothing was detected)."""
+
+    def __init__(self, landmarks):
+        self.pose_landmarks = CachedLandmarks(landmarks) if landmarks is not None else None
+
+
+def video_fingerprint(path, block_size=1 << 20):
+
+    """Content fingerprint of a video file: its size plus a hash of the first and last block_size bytes.
+
+    Renamed or copied videos keep their cached detections, re-encoded ones get new entries.
+    """
+
+    size = os.path.getsize(path)
+    digest = hashlib.sha1(str(size).encode('ascii'))
+    with open(path, 'rb') as fin:
+        digest.update(fin.read(block_size))
+        if size > block_size:
+            fin.seek(max(size - block_size, block_size))
+            digest.update(fin.read(block_size))
+    return digest.hexdigest()
+
+
+def pose_settings_key(**pose_settings):
+
+    """Key of the mp_pose.Pose settings, detections of different settings are cached separately.
+
+    Anything else that changes the detections, e.g. the inference_size frames are downscaled to, is passed along.
+    """
+
+    try:
+        import mediapipe
+        version = mediapipe.__version__
+    except (ImportError, AttributeError):
+        version = 'unknown'
+    return json.dumps({'mediapipe': version, **pose_settings}, sort_keys=True)
+
+
+class DetectionCache:
+
+    """Persistent cache of mediapipe pose detections, keyed by video fingerprint, Pose settings and frame index.
+
+    All 33 landmarks with visibility are stored per frame, so reruns with different keypoint subsets,
+    thresholds downstream or a new calibration only run inference on frames that are not cached yet.
+    The cache is a sqlite database in WAL mode, which makes it safe to share between concurrent batch jobs
+    on one machine. When it grows over max_bytes the least recently used frames are evicted.
+
+    Example:
+        cache = DetectionCache('detections.sqlite', max_bytes=2 * 1024**3)
+        kpts_3d = run_mp(input_streams, rig, headless=True, cache=cache)
+    """
+
+    def __init__(self, path, max_bytes=2 * 1024**3, commit_every=256):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.commit_every = commit_every
+        self._lock = threading.Lock()
+        self._pending = []
+
+        self._connection = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('PRAGMA synchronous=NORMAL')
+        with self._connection:
+            self._connection.execute('CREATE TABLE IF NOT EXISTS detections ('
+                                     'video TEXT NOT NULL, settings TEXT NOT NULL, frame INTEGER NOT NULL, '
+                                     'landmarks BLOB NOT NULL, last_access REAL NOT NULL, '
+                                     'PRIMARY KEY (video, settings, frame))')
+            self._connection.execute('CREATE INDEX IF NOT EXISTS detections_last_access ON detections (last_access)')
+
+    def get_range(self, video, settings, start, stop):
+
+        """Cached detections of the frames start..stop-1 as {frame_index: landmarks}.
+
+        landmarks is a (33, 4) float32 array, or None if mediapipe found no pose in that frame.
+        Frames that are not cached are missing from the dict.
+        """
+
+        with self._lock:
+            rows = self._connection.execute('SELECT frame, landmarks FROM detections '
+                                            'WHERE video = ? AND settings = ? AND frame >= ? AND frame < ?',
+                                            (video, settings, start, stop)).fetchall()
+            if rows:
+                with self._connection:
+                    self._connection.execute('UPDATE detections SET last_access = ? '
+                                             'WHERE video = ? AND settings = ? AND frame >= ? AND frame < ?',
+                                             (time.time(), video, settings, start, stop))
+
+        return {frame: _decode_landmarks(blob) for frame, blob in rows}
+
+    def put(self, video, settings, frame_index, landmarks):
+
+        """Store the (33, 4) landmarks of a frame, None if no pose was detected. Writes are committed in batches."""
+
+        blob = b'' if landmarks is None else np.asarray(landmarks, dtype=np.float32).tobytes()
+        with self._lock:
+            self._pending.append((video, settings, frame_index, blob, time.time()))
+            if len(self._pending) >= self.commit_every:
+                self._commit()
+
+    def flush(self):
+        with self._lock:
+            self._commit()
+
+    def _commit(self):
+        if not self._pending:
+            return
+        with self._connection:
+            self._connection.executemany('INSERT OR REPLACE INTO detections VALUES (?, ?, ?, ?, ?)', self._pending)
+        self._pending = []
+        self._evict()
+
+    def size_bytes(self):
+        page_count = self._connection.execute('PRAGMA page_count').fetchone()[0]
+        free_pages = self._connection.execute('PRAGMA freelist_count').fetchone()[0]
+        page_size = self._connection.execute('PRAGMA page_size').fetchone()[0]
+        return (page_count - free_pages) * page_size
+
+    def _evict(self, batch_size=1000):
+        # least recently used frames go first, down to 90% of the limit so eviction does not run on every commit
+        if self.max_bytes is None or self.size_bytes() <= self.max_bytes:
+            return
+        while self.size_bytes() > 0.9 * self.max_bytes:
+            with self._connection:
+                deleted = self._connection.execute('DELETE FROM detections WHERE rowid IN '
+                                                   '(SELECT rowid FROM detections ORDER BY last_access LIMIT ?)',
+                                                   (batch_size,)).rowcount
+            if deleted == 0:
+                break
+
+    def close(self):
+        self.flush()
+        self._connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def _decode_landmarks(blob):
+    if len(blob) == 0:
+        return None
+    return np.frombuffer(blob, dtype=np.float32).reshape((NUM_LANDMARKS, 4))
+
+
+def landmarks_to_array(results):
+
+    """All pose landmarks of a Pose.process output as a (33, 4) float32 array of x, y, z, visibility, None without detection."""
+
+    if not results.pose_landmarks:
+        return None
+    return np.array([(l.x, l.y, l.z, l.visibility) for l in results.pose_landmarks.landmark], dtype=np.float32)
+
+
+class CachedPose:
+
+    """Wraps an mp_pose.Pose of one video so that process() answers from the DetectionCache when it can.
+
+    process() is called once per frame in order, like Pose.process. Cached frames are read ahead in blocks
+    of prefetch frames, misses are inferred with the wrapped Pose and stored. Note that skipping cached
+    frames also skips mediapipe's tracking between them.
+    """
+
+    def __init__(self, pose, cache, video, settings, prefetch=256):
+        self.pose = pose
+        self.cache = cache
+        self.video = video
+        self.settings = settings
+        self.prefetch = prefetch
+        self.frame_index = 0
+        self.hits = 0
+        self.misses = 0
+        self._block = {}
+        self._block_end = 0
+
+    def process(self, frame):
+        if self.frame_index >= self._block_end:
+            self._block = self.cache.get_range(self.video, self.settings, self.frame_index, self.frame_index + self.prefetch)
+            self._block_end = self.frame_index + self.prefetch
+
+        if self.frame_index in self._block:
+            self.hits += 1
+            results = CachedResults(self._block[self.frame_index])
+        else:
+            self.misses += 1
+            results = self.pose.process(frame)
+            self.cache.put(self.video, self.settings, self.frame_index, landmarks_to_array(results))
+
+        self.frame_index += 1
+        return results
@@ -0,0 +1,196 @@
+import threading
+import time
+import cv2 as cv
+import numpy as np
+from utils import detect_keypoints
+
+
+class CameraGrabber(threading.Thread):
+
+    """Background thread that keeps reading one live camera and holds on to its latest frame only.
+
+    Every frame is stamped with time.monotonic() when cap.read returns. A frame that was not taken
+    before the next one arrived is dropped (latest frame wins), so a slow consumer never builds up a
+    backlog. Failed reads are retried with a delay that backs off from retry_delay to max_retry_delay, the
+    camera is only given up once its reads kept failing for give_up_after seconds (never if it is None).
+    """
+
+    def __init__(self, cap, condition, give_up_after=10.0, retry_delay=0.01, max_retry_delay=0.5):
+        super().__init__(daemon=True)
+        self.cap = cap
+        self.condition = condition
+        self.give_up_after = give_up_after
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.ended = False
+        self.grabbed = 0
+        self.dropped = 0
+        self.failures = 0
+        self._latest = None
+        self._stop_event = threading.Event()
+
+    def run(self):
+        failing_since = None
+        delay = self.retry_delay
+        while not self._stop_event.is_set():
+            ret, frame = self.cap.read()
+            timestamp = time.monotonic()
+            if not ret:
+                # camera hiccup, keep trying before giving up on it
+                self.failures += 1
+                if failing_since is None:
+                    failing_since = timestamp
+                elif self.give_up_after is not None and timestamp - failing_since >= self.give_up_after:
+                    break
+                self._stop_event.wait(delay)
+                delay = min(delay * 2, self.max_retry_delay)
+                continue
+            failing_since = None
+            delay = self.retry_delay
+
+            with self.condition:
+                if self._latest is not None:
+                    self.dropped += 1
+                self._latest = (timestamp, frame)
+                self.grabbed += 1
+                self.condition.notify_all()
+
+        with self.condition:
+            self.ended = True
+            self.condition.notify_all()
+
+    def peek(self):
+        # timestamp of the frame waiting to be taken, None if there is none. Call with the condition held
+        return self._latest[0] if self._latest is not None else None
+
+    def take(self):
+        # hand the waiting frame over to the consumer. Call with the condition held
+        latest = self._latest
+        self._latest = None
+        return latest
+
+    def stop(self):
+        self._stop_event.set()
+
+
+class FrameSynchronizer:
+
+    """Pairs the frames of several live cameras by capture timestamp.
+
+    Each camera is read by its own CameraGrabber. A frame set is emitted as soon as every running camera
+    delivered a new frame, or max_wait seconds after the first new frame arrived. The newest frame is the
+    reference, frames older than it by more than tolerance seconds are stale and dropped. Cameras without
+    a matching frame are None in the set, so a hiccup of one camera never stalls the others. Only the
+    latest frame of each camera is kept, which bounds the latency however long the session runs. A camera
+    whose reads keep failing for give_up_after seconds is treated as ended (None keeps retrying forever).
+
+    Example:
+        synchronizer = FrameSynchronizer(caps, tolerance=0.033)
+        for timestamp, frames in synchronizer:
+            ...
+        synchronizer.print_stats()
+    """
+
+    def __init__(self, caps, tolerance=0.033, max_wait=0.05, give_up_after=10.0):
+        self.tolerance = tolerance
+        self.max_wait = max_wait
+        self._condition = threading.Condition()
+        self._grabbers = [CameraGrabber(cap, self._condition, give_up_after) for cap in caps]
+        self.emitted = 0
+        self.stale = [0] * len(caps)
+        self.missing = [0] * len(caps)
+
+    def __iter__(self):
+        for grabber in self._grabbers:
+            grabber.start()
+
+        try:
+            while True:
+                frame_set = self._next_frame_set()
+                if frame_set is None:
+                    return  # every camera ended
+                self.emitted += 1
+                yield frame_set
+        finally:
+            self.close()
+
+    def _next_frame_set(self):
+        with self._condition:
+            # wait for the first new frame of any camera
+            while not any(grabber.peek() is not None for grabber in self._grabbers):
+                if all(grabber.ended for grabber in self._grabbers):
+                    return None
+                self._condition.wait(0.1)
+
+            # then give the other running cameras up to max_wait to catch up
+            deadline = time.monotonic() + self.max_wait
+            while not all(grabber.peek() is not None or grabber.ended for grabber in self._grabbers):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._condition.wait(remaining)
+
+            latest = [grabber.take() for grabber in self._grabbers]
+
+        reference = max(item[0] for item in latest if item is not None)
+        frames = []
+        for i, item in enumerate(latest):
+            if item is None:
+                self.missing[i] += 1
+                frames.append(None)
+            elif reference - item[0] > self.tolerance:
+                self.stale[i] += 1
+                frames.append(None)
+            else:
+                frames.append(item[1])
+        return reference, frames
+
+    def close(self):
+        for grabber in self._grabbers:
+            grabber.stop()
+        for grabber in self._grabbers:
+            if grabber.is_alive():
+                grabber.join()
+
+    def stats(self):
+
+        """Per camera counters: grabbed frames, frames dropped by newer ones, stale and missing frame sets, failed reads."""
+
+        return [{'grabbed': grabber.grabbed, 'dropped': grabber.dropped, 'stale': self.stale[i],
+                 'missing': self.missing[i], 'failures': grabber.failures}
+                for i, grabber in enumerate(self._grabbers)]
+
+    def print_stats(self):
+        print(f'frame sets: {self.emitted}')
+        print('camera  grabbed  dropped    stale  missing  failures')
+        for i, camera_stats in enumerate(self.stats()):
+            print(f"cam{i:<4} {camera_stats['grabbed']:>8} {camera_stats['dropped']:>8} {camera_stats['stale']:>8} "
+                  f"{camera_stats['missing']:>8} {camera_stats['failures']:>9}")
+
+
+def read_frames_synchronized(caps, poses, pose_keypoints, headless=False, tolerance=0.033, max_wait=0.05, give_up_after=10.0,
+                             synchronizer=None):
+
+    """Yield (frames, keypoints, valid) of every synchronized frame set of live cameras.
+
+    Cameras without a frame in the set are None in frames, with keypoints of -1 and an all False valid
+    mask, so triangulation uses whichever cameras are present.
+    """
+
+    if synchronizer is None:
+        synchronizer = FrameSynchronizer(caps, tolerance, max_wait, give_up_after)
+
+    frames_rgb = [None] * len(caps)
+    for timestamp, frames in synchronizer:
+        keypoints = np.full((len(caps), len(pose_keypoints), 2), -1, dtype=np.float32)
+        valid = np.zeros((len(caps), len(pose_keypoints)), dtype=bool)
+        for i, (pose, frame) in enumerate(zip(poses, frames)):
+            if frame is None:
+                continue
+            frames_rgb[i] = cv.cvtColor(frame, cv.COLOR_BGR2RGB, dst=frames_rgb[i])
+            frames_rgb[i].flags.writeable = False
+            result = pose.process(frames_rgb[i])
+            frames_rgb[i].flags.writeable = True
+            keypoints[i], visibility, valid[i] = detect_keypoints(frame, result, pose_keypoints, draw=not headless)
+
+        yield frames, keypoints, valid
@@ -0,0 +1,160 @@
+import cv2 as cv
+import numpy as np
+from utils import detect_keypoints, draw_keypoints
+
+
+class KeyframeTracker:
+
+    """Runs Pose.process on keyframes only and tracks the keypoints with pyramidal Lucas-Kanade optical flow in between.
+
+    A keyframe is forced after stride frames, when no keypoint is left to track or when more than max_lost of the
+    tracked keypoints were lost. After every keyframe the stride adapts to the motion since the previous one:
+    it is halved if the keypoints moved faster than high_motion pixels per frame and grows by one below low_motion.
+    At every keyframe the tracked keypoints are compared with the new detection, this drift is the accuracy cost
+    of tracking and is reported by stats().
+
+    Example:
+        trackers = [KeyframeTracker(pose, pose_keypoints) for pose in poses]
+        keypoints, valid = trackers[0].process(frame)
+    """
+
+    def __init__(self, pose, pose_keypoints, stride=5, min_stride=1, max_stride=15, low_motion=2.0, high_motion=8.0,
+                 max_flow_error=20.0, max_lost=0.25, win_size=(21, 21), max_level=3):
+        self.pose = pose
+        self.pose_keypoints = pose_keypoints
+        self.stride = stride
+        self.min_stride = min_stride
+        self.max_stride = max_stride
+        self.low_motion = low_motion
+        self.high_motion = high_motion
+        self.max_flow_error = max_flow_error
+        self.max_lost = max_lost
+        self.lk_params = dict(winSize=win_size, maxLevel=max_level,
+                              criteria=(cv.TERM_CRITERIA_EPS | cv.TERM_CRITERIA_COUNT, 30, 0.01))
+
+        self.keypoints = np.full((len(pose_keypoints), 2), -1, dtype=np.float32)
+        self.valid = np.zeros(len(pose_keypoints), dtype=bool)
+        self.frames = 0
+        self.detections = 0
+        self.drift = []
+
+        self._gray = [None, None]
+        self._prev_gray = None
+        self._frame_rgb = None
+        self._frames_since_keyframe = 0
+        self._motion = []
+
+    def _track(self, gray):
+        # follow the valid keypoints from the previous frame, lost ones become invalid
+        indices = np.flatnonzero(self.valid)
+        p0 = self.keypoints[indices].reshape((-1, 1, 2))
+        p1, status, error = cv.calcOpticalFlowPyrLK(self._prev_gray, gray, p0, None, **self.lk_params)
+        p1 = p1.reshape((-1, 2))
+
+        height, width = gray.shape
+        ok = (status.ravel() == 1) & (error.ravel() < self.max_flow_error)
+        ok &= (p1[:, 0] >= 0) & (p1[:, 0] < width) & (p1[:, 1] >= 0) & (p1[:, 1] < height)
+
+        keypoints = np.full_like(self.keypoints, -1)
+        valid = np.zeros_like(self.valid)
+        keypoints[indices[ok]] = p1[ok]
+        valid[indices[ok]] = True
+
+        motion = np.median(np.linalg.norm(p1[ok] - p0.reshape((-1, 2))[ok], axis=1)) if ok.any() else np.inf
+        lost = 1 - ok.sum() / len(indices)
+        return keypoints, valid, motion, lost
+
+    def _detect(self, frame, headless):
+        self._frame_rgb = cv.cvtColor(frame, cv.COLOR_BGR2RGB, dst=self._frame_rgb)
+        self._frame_rgb.flags.writeable = False
+        result = self.pose.process(self._frame_rgb)
+        self._frame_rgb.flags.writeable = True
+        keypoints, visibility, valid = detect_keypoints(frame, result, self.pose_keypoints, draw=not headless)
+        self.detections += 1
+        return keypoints.copy(), valid
+
+    def _adapt_stride(self):
+        if not self._motion:
+            return
+        motion = np.mean(self._motion)
+        if motion > self.high_motion:
+            self.stride = max(self.min_stride, self.stride // 2)
+        elif motion < self.low_motion:
+            self.stride = min(self.max_stride, self.stride + 1)
+        self._motion = []
+
+    def process(self, frame, headless=False):
+
+        """Keypoints of the next frame of the camera as ((K, 2) float32 pixel coordinates, (K,) valid mask)."""
+
+        buffer_index = self.frames % 2
+        gray = cv.cvtColor(frame, cv.COLOR_BGR2GRAY, dst=self._gray[buffer_index])
+        self._gray[buffer_index] = gray
+        self.frames += 1
+
+        tracked = None
+        if self._prev_gray is not None and self.valid.any():
+            tracked = self._track(gray)
+
+        keyframe = (tracked is None or self._frames_since_keyframe + 1 >= self.stride or tracked[3] > self.max_lost)
+        if keyframe:
+            keypoints, valid = self._detect(frame, headless)
+            if tracked is not None:
+                both = valid & tracked[1]
+                if both.any():
+                    self.drift.append(float(np.mean(np.linalg.norm(keypoints[both] - tracked[0][both], axis=1))))
+                self._motion.append(tracked[2])
+            self._adapt_stride()
+            self._frames_since_keyframe = 0
+        else:
+            keypoints, valid, motion, lost = tracked
+            self._motion.append(motion)
+            self._frames_since_keyframe += 1
+            if not headless:
+                draw_keypoints(frame, keypoints, valid)
+
+        self.keypoints = keypoints
+        self.valid = valid
+        self._prev_gray = gray
+        return keypoints, valid
+
+    def stats(self):
+
+        """speedup is the number of frames per Pose.process call, drift the pixel distance between tracked
+        and detected keypoints at keyframes (mean and 95th percentile)."""
+
+        drift = np.array(self.drift) if self.drift else np.zeros(1)
+        return {'frames': self.frames, 'detections': self.detections,
+                'speedup': self.frames / max(self.detections, 1), 'stride': self.stride,
+                'mean_drift_px': float(np.mean(drift)), 'p95_drift_px': float(np.percentile(drift, 95))}
+
+
+def print_keyframe_stats(trackers):
+    print('camera   frames  detections  speedup  stride  mean drift [px]  p95 drift [px]')
+    for i, tracker in enumerate(trackers):
+        stats = tracker.stats()
+        print(f"cam{i:<4} {stats['frames']:>8} {stats['detections']:>11} {stats['speedup']:>8.2f} {stats['stride']:>7} "
+              f"{stats['mean_drift_px']:>16.2f} {stats['p95_drift_px']:>15.2f}")
+
+
+def read_frames_keyframes(caps, trackers, headless=False):
+
+    """Yield (frames, keypoints, valid) of every frame index, with one KeyframeTracker per camera.
+
+    Like read_frames_serial, but Pose.process only runs on the keyframes of each camera.
+    """
+
+    frames = [None] * len(caps)
+    while True:
+        keypoints = []
+        valid = []
+        for i, (cap, tracker) in enumerate(zip(caps, trackers)):
+            ret, frame = cap.read(frames[i])
+            if not ret:
+                return  # End of video reached
+            frames[i] = frame
+            frame_keypoints, frame_valid = tracker.process(frame, headless)
+            keypoints.append(frame_keypoints)
+            valid.append(frame_valid)
+
+        yield frames, np.stack(keypoints), np.stack(valid)
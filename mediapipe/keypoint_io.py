@@ -0,0 +1,227 @@
+import glob
+import itertools
+import os
+import re
+import struct
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+# Binary keypoint file (.kpts):
+#   fixed 64 byte little endian header: magic, version, dtype, frame count, keypoint count,
+#   dimensionality (2 or 3) and camera id (-1 for 3D keypoints),
+#   followed by one contiguous C ordered (frames, keypoints, dim) block.
+BINARY_EXTENSION = '.kpts'
+_MAGIC = b'KPTS'
+_VERSION = 1
+_HEADER_FORMAT = '<4sH8sQIIi'
+HEADER_SIZE = 64
+
+
+def _pack_header(num_frames, num_keypoints, dim, dtype, camera_id):
+    header = struct.pack(_HEADER_FORMAT, _MAGIC, _VERSION, np.dtype(dtype).str.encode('ascii'),
+                         num_frames, num_keypoints, dim, camera_id)
+    return header.ljust(HEADER_SIZE, b'\0')
+
+
+def read_keypoints_header(filename):
+
+    """Return the header of a binary keypoint file as a dict."""
+
+    with open(filename, 'rb') as fin:
+        raw = fin.read(HEADER_SIZE)
+
+    if len(raw) < HEADER_SIZE or raw[:4] != _MAGIC:
+        raise ValueError(f"{filename} is not a binary keypoint file.")
+
+    magic, version, dtype, num_frames, num_keypoints, dim, camera_id = struct.unpack_from(_HEADER_FORMAT, raw)
+    if version != _VERSION:
+        raise ValueError(f"Unsupported keypoint file version {version} in {filename}.")
+
+    return {'num_frames': num_frames,
+            'num_keypoints': num_keypoints,
+            'dim': dim,
+            'dtype': np.dtype(dtype.rstrip(b'\0').decode('ascii')),
+            'camera_id': camera_id}
+
+
+def is_binary_keypoint_file(filename):
+    with open(filename, 'rb') as fin:
+        return fin.read(4) == _MAGIC
+
+
+def write_keypoints_binary(filename, kpts, camera_id=-1, dtype=np.float32):
+
+    """Write a (frames, keypoints, dim) array as a binary keypoint file in one go.
+
+    Args:
+        filename (str): output path, by convention ending with .kpts.
+        kpts (numpy.ndarray): keypoints of all frames, (F, K, 2) for a camera or (F, K, 3) for 3D points.
+        camera_id (int, optional): camera the 2D keypoints belong to, -1 for 3D keypoints. Default is -1.
+        dtype (optional): storage dtype. Default is float32.
+    """
+
+    kpts = np.ascontiguousarray(kpts, dtype=dtype)
+    if kpts.ndim != 3:
+        raise ValueError("kpts must have the shape (frames, keypoints, dim).")
+
+    with open(filename, 'wb') as fout:
+        fout.write(_pack_header(kpts.shape[0], kpts.shape[1], kpts.shape[2], kpts.dtype, camera_id))
+        kpts.tofile(fout)
+
+
+def read_keypoints_binary(filename, mode='r'):
+
+    """Map a binary keypoint file into memory.
+
+    Returns:
+        numpy.memmap: (frames, keypoints, dim) view of the file. Nothing is read until frames are
+        accessed, so opening a long session is near instant.
+    """
+
+    header = read_keypoints_header(filename)
+    shape = (header['num_frames'], header['num_keypoints'], header['dim'])
+    if header['num_frames'] == 0:
+        return np.empty(shape, dtype=header['dtype'])
+    return np.memmap(filename, dtype=header['dtype'], mode=mode, offset=HEADER_SIZE, shape=shape)
+
+
+class BinaryKeypointWriter:
+
+    """Incremental writer of a binary keypoint file.
+
+    Frames are appended to the data block and the frame count in the header is updated on every flush,
+    so the file is readable up to the last flush even if the writing process dies.
+    """
+
+    def __init__(self, filename, num_keypoints, dim, camera_id=-1, dtype=np.float32):
+        self.num_keypoints = num_keypoints
+        self.dim = dim
+        self.camera_id = camera_id
+        self.dtype = np.dtype(dtype)
+        self.num_frames = 0
+
+        self._fout = open(filename, 'wb')
+        self._fout.write(_pack_header(0, num_keypoints, dim, self.dtype, camera_id))
+
+    def append(self, kpts):
+
+        """Append a (frames, keypoints, dim) block, or a single (keypoints, dim) frame."""
+
+        kpts = np.ascontiguousarray(kpts, dtype=self.dtype).reshape((-1, self.num_keypoints, self.dim))
+        kpts.tofile(self._fout)
+        self.num_frames += len(kpts)
+
+    def flush(self):
+        # data first, then the header that makes it visible
+        self._fout.flush()
+        self._fout.seek(0)
+        self._fout.write(_pack_header(self.num_frames, self.num_keypoints, self.dim, self.dtype, self.camera_id))
+        self._fout.seek(0, os.SEEK_END)
+        self._fout.flush()
+        os.fsync(self._fout.fileno())
+
+    def close(self):
+        self.flush()
+        self._fout.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def append_keypoints_text(fout, kpts):
+
+    """Append (frames, keypoints, dim) keypoints to an open text file, in the layout of write_keypoints_to_disk
+    (one frame per line, every coordinate followed by a space)."""
+
+    lines = [' '.join(map(str, frame)) + ' \n' for frame in np.reshape(kpts, (len(kpts), -1)).tolist()]
+    fout.write(''.join(lines))
+
+
+def _parse_text_lines(lines, num_keypoints, dtype):
+    # one vectorized parse of all lines, every line is one frame of num_keypoints * dim floats
+    if len(lines) == 0:
+        return np.empty((0, num_keypoints, 0), dtype=dtype)
+    data = np.loadtxt(lines, dtype=dtype, ndmin=2)
+    return data.reshape((len(data), num_keypoints, -1))
+
+
+def read_keypoints_text(filename, num_keypoints=12, start=0, stop=None, dtype=np.float32):
+
+    """Read a legacy text keypoint file (one frame per line) in one vectorized pass.
+
+    Args:
+        filename (str): path to a .dat file written by write_keypoints_to_disk.
+        num_keypoints (int, optional): keypoints per frame. Default is 12.
+        start (int, optional): first frame to read. Default is 0.
+        stop (int, optional): frame to stop before, None reads until the end of the file.
+        dtype (optional): dtype of the returned array. Default is float32.
+
+    Returns:
+        numpy.ndarray: (frames, keypoints, dim) array.
+    """
+
+    with open(filename, 'r') as fin:
+        lines = list(itertools.islice(fin, start, stop))
+    return _parse_text_lines(lines, num_keypoints, dtype)
+
+
+def iter_keypoints_text(filename, chunk_frames=10000, num_keypoints=12, dtype=np.float32):
+
+    """Yield a legacy text keypoint file as (frames, keypoints, dim) chunks of at most chunk_frames frames,
+    so huge files can be processed in bounded memory."""
+
+    with open(filename, 'r') as fin:
+        while True:
+            lines = list(itertools.islice(fin, chunk_frames))
+            if not lines:
+                return
+            yield _parse_text_lines(lines, num_keypoints, dtype)
+
+
+def convert_text_file(filename, output_filename=None, num_keypoints=12, chunk_frames=10000):
+
+    """Convert a legacy text keypoint file to a binary .kpts file, chunk by chunk.
+
+    The camera id is taken from kpts_cam{i} file names, every other file is stored as 3D (-1).
+    """
+
+    if output_filename is None:
+        output_filename = os.path.splitext(filename)[0] + BINARY_EXTENSION
+
+    match = re.search(r'cam_?(\d+)', os.path.basename(filename))
+    camera_id = int(match.group(1)) if match else -1
+
+    writer = None
+    for chunk in iter_keypoints_text(filename, chunk_frames, num_keypoints):
+        if writer is None:
+            writer = BinaryKeypointWriter(output_filename, num_keypoints, chunk.shape[2], camera_id)
+        writer.append(chunk)
+
+    if writer is None:
+        #empty input, the dimensionality follows from the camera id
+        writer = BinaryKeypointWriter(output_filename, num_keypoints, 3 if camera_id == -1 else 2, camera_id)
+    writer.close()
+    return output_filename
+
+
+def convert_text_directory(input_folder, output_folder=None, num_keypoints=12, processes=None):
+
+    """Convert every .dat keypoint file of a folder to the binary format, one file per worker process.
+
+    Returns:
+        list: paths of the written .kpts files.
+    """
+
+    if output_folder is None:
+        output_folder = input_folder
+    if not os.path.exists(output_folder):
+        os.makedirs(output_folder)
+
+    filenames = sorted(glob.glob(os.path.join(input_folder, '*.dat')))
+    output_filenames = [os.path.join(output_folder, os.path.splitext(os.path.basename(f))[0] + BINARY_EXTENSION) for f in filenames]
+
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        return list(executor.map(convert_text_file, filenames, output_filenames, [num_keypoints] * len(filenames)))
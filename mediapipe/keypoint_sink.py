@@ -0,0 +1,109 @@
+import os
+import numpy as np
+from keypoint_io import BINARY_EXTENSION, BinaryKeypointWriter, append_keypoints_text
+
+
+class KeypointStreamWriter:
+
+    """Streaming sink for the keypoints of long run_mp sessions.
+
+    Every frame's 2D keypoints of each camera and its 3D keypoints are appended to kpts_cam{i}.dat and
+    kpts_3d.dat in output_folder, in the same text format as write_keypoints_to_disk. Frames are written
+    in chunks of chunk_size and synced to disk, so a crash loses at most one chunk. Only the last
+    ring_size frames are kept in memory for live consumers, which keeps memory constant however long
+    the session runs. With binary=True the files are written as .kpts binary keypoint files instead.
+
+    Example:
+        with KeypointStreamWriter('output/', num_cameras=3, num_keypoints=12) as sink:
+            run_mp(input_streams, rig, sink=sink)
+            latest_3d = sink.latest_3d(30)
+    """
+
+    def __init__(self, output_folder, num_cameras, num_keypoints, chunk_size=100, ring_size=300, binary=False):
+        if not os.path.exists(output_folder):
+            os.makedirs(output_folder)
+
+        self.num_cameras = num_cameras
+        self.num_keypoints = num_keypoints
+        self.chunk_size = chunk_size
+        self.frame_count = 0
+
+        if binary:
+            self._files_2d = [BinaryKeypointWriter(os.path.join(output_folder, f'kpts_cam{i}' + BINARY_EXTENSION), num_keypoints, 2, camera_id=i)
+                              for i in range(num_cameras)]
+            self._file_3d = BinaryKeypointWriter(os.path.join(output_folder, 'kpts_3d' + BINARY_EXTENSION), num_keypoints, 3)
+        else:
+            self._files_2d = [open(os.path.join(output_folder, f'kpts_cam{i}.dat'), 'w') for i in range(num_cameras)]
+            self._file_3d = open(os.path.join(output_folder, 'kpts_3d.dat'), 'w')
+        self.binary = binary
+
+        # frames not written yet
+        self._pending_2d = np.empty((chunk_size, num_cameras, num_keypoints, 2), dtype=np.float32)
+        self._pending_3d = np.empty((chunk_size, num_keypoints, 3))
+        self._num_pending = 0
+
+        # fixed size ring buffer of the latest frames
+        self._ring_2d = np.full((ring_size, num_cameras, num_keypoints, 2), -1, dtype=np.float32)
+        self._ring_3d = np.full((ring_size, num_keypoints, 3), -1.0)
+
+    def append(self, keypoints_2d, keypoints_3d):
+
+        """Add one frame, keypoints_2d is (C, K, 2) and keypoints_3d is (K, 3)."""
+
+        slot = self.frame_count % len(self._ring_3d)
+        self._ring_2d[slot] = keypoints_2d
+        self._ring_3d[slot] = keypoints_3d
+        self.frame_count += 1
+
+        self._pending_2d[self._num_pending] = keypoints_2d
+        self._pending_3d[self._num_pending] = keypoints_3d
+        self._num_pending += 1
+        if self._num_pending == self.chunk_size:
+            self.flush()
+
+    def flush(self):
+
+        """Write the pending frames to disk and sync the files."""
+
+        n = self._num_pending
+        if n > 0:
+            for i, fout in enumerate(self._files_2d):
+                _write_frames(fout, self._pending_2d[:n, i])
+            _write_frames(self._file_3d, self._pending_3d[:n])
+            self._num_pending = 0
+
+        for fout in self._files_2d + [self._file_3d]:
+            fout.flush()
+            if not self.binary:
+                os.fsync(fout.fileno())
+
+    def latest_2d(self, n=1):
+        return self._latest(self._ring_2d, n)
+
+    def latest_3d(self, n=1):
+        return self._latest(self._ring_3d, n)
+
+    def _latest(self, ring, n):
+        # last n frames in order, oldest first
+        n = min(n, self.frame_count, len(ring))
+        slots = np.arange(self.frame_count - n, self.frame_count) % len(ring)
+        return ring[slots]
+
+    def close(self):
+        self.flush()
+        for fout in self._files_2d + [self._file_3d]:
+            fout.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def _write_frames(fout, frames):
+    if isinstance(fout, BinaryKeypointWriter):
+        fout.append(frames)
+        return
+
+    append_keypoints_text(fout, frames)
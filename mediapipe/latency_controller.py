@@ -0,0 +1,141 @@
+import collections
+import threading
+import time
+import cv2 as cv
+import mediapipe as mp
+import numpy as np
+
+# Pose settings from the most accurate to the cheapest. Lower thresholds keep mediapipe in its cheap
+# tracking mode instead of re-running the person detector, inference_size downscales the frames
+# (longer side in pixels, None keeps the resolution).
+DEFAULT_LEVELS = [
+    dict(model_complexity=2, inference_size=None, min_detection_confidence=0.85, min_tracking_confidence=0.85),
+    dict(model_complexity=1, inference_size=None, min_detection_confidence=0.85, min_tracking_confidence=0.85),
+    dict(model_complexity=1, inference_size=960, min_detection_confidence=0.7, min_tracking_confidence=0.7),
+    dict(model_complexity=1, inference_size=640, min_detection_confidence=0.6, min_tracking_confidence=0.6),
+    dict(model_complexity=0, inference_size=640, min_detection_confidence=0.5, min_tracking_confidence=0.5),
+    dict(model_complexity=0, inference_size=480, min_detection_confidence=0.5, min_tracking_confidence=0.3),
+]
+
+
+class LatencyController:
+
+    """Keeps the inference time per frame within a budget by switching between pose setting levels.
+
+    Every AdaptivePose records how long its Pose.process calls take. Once window calls of every camera
+    were measured at the current level, the frame cost is estimated from the per camera means (summed for
+    cameras processed one after another, the maximum for cameras processed concurrently):
+    above overload * frame_budget the controller falls back to the cheapest level at once, above the budget
+    it goes one level cheaper and below headroom * frame_budget one level more accurate. Every switch is logged.
+
+    Example:
+        controller = LatencyController(frame_budget=1 / 30)
+        poses = [AdaptivePose(controller, i) for i in range(num_cameras)]
+    """
+
+    def __init__(self, frame_budget, levels=None, level=1, window=30, headroom=0.5, overload=1.5, concurrent=False, log=print):
+        self.frame_budget = frame_budget
+        self.levels = levels if levels is not None else DEFAULT_LEVELS
+        self.level = level
+        self.window = window
+        self.headroom = headroom
+        self.overload = overload
+        self.concurrent = concurrent
+        self.log = log
+        self.switches = []
+        self._times = collections.defaultdict(lambda: collections.deque(maxlen=window))
+        self._level_since = time.perf_counter()
+        self._level_durations = collections.Counter()
+        self._lock = threading.Lock()
+
+    @property
+    def settings(self):
+        return self.levels[self.level]
+
+    def record(self, camera_index, seconds):
+
+        """Record the duration of one Pose.process call of a camera at the current level."""
+
+        with self._lock:
+            self._times[camera_index].append(seconds)
+            if all(len(times) == self.window for times in self._times.values()):
+                self._update()
+
+    def frame_cost(self):
+        means = [np.mean(times) for times in self._times.values() if times]
+        if not means:
+            return 0.0
+        return max(means) if self.concurrent else sum(means)
+
+    def _update(self):
+        cost = self.frame_cost()
+        cheapest = len(self.levels) - 1
+        if cost > self.overload * self.frame_budget and self.level < cheapest:
+            self._switch(cheapest, 'overloaded', cost)
+        elif cost > self.frame_budget and self.level < cheapest:
+            self._switch(self.level + 1, 'over budget', cost)
+        elif cost < self.headroom * self.frame_budget and self.level > 0:
+            self._switch(self.level - 1, 'headroom', cost)
+
+    def _switch(self, level, reason, cost):
+        now = time.perf_counter()
+        self._level_durations[self.level] += now - self._level_since
+        self._level_since = now
+        self.switches.append((time.time(), self.level, level, reason, cost))
+        self.log(f'latency controller: level {self.level} -> {level} ({reason}, {cost * 1000:.1f} ms per frame, '
+                 f'budget {self.frame_budget * 1000:.1f} ms): {self.levels[level]}')
+        self.level = level
+        # measurements of the old level say nothing about the new one
+        for times in self._times.values():
+            times.clear()
+
+    def print_summary(self):
+        durations = collections.Counter(self._level_durations)
+        durations[self.level] += time.perf_counter() - self._level_since
+        print(f'latency controller: {len(self.switches)} switches, final level {self.level}')
+        for level in sorted(durations):
+            print(f'  level {level}: {durations[level]:.1f} s  {self.levels[level]}')
+
+
+class AdaptivePose:
+
+    """Drop-in replacement of mp_pose.Pose of one camera whose settings follow a LatencyController.
+
+    The Pose object is recreated when the controller switches levels. Frames are downscaled to the
+    inference size of the level, mediapipe returns normalized landmarks so detect_keypoints still maps
+    them to full resolution pixels of the original frame.
+    """
+
+    def __init__(self, controller, camera_index):
+        self.controller = controller
+        self.camera_index = camera_index
+        self.level = None
+        self.pose = None
+        self._small = None
+
+    def _make_pose(self, settings):
+        if self.pose is not None:
+            self.pose.close()
+        pose_settings = {key: value for key, value in settings.items() if key != 'inference_size'}
+        self.pose = mp.solutions.pose.Pose(**pose_settings)
+
+    def process(self, frame):
+        level = self.controller.level
+        settings = self.controller.levels[level]
+        if level != self.level:
+            self._make_pose(settings)
+            self.level = level
+
+        inference_size = settings['inference_size']
+        if inference_size is not None and max(frame.shape[:2]) > inference_size:
+            scale = inference_size / max(frame.shape[:2])
+            size = (int(round(frame.shape[1] * scale)), int(round(frame.shape[0] * scale)))
+            if self._small is None or self._small.shape[1::-1] != size:
+                self._small = None
+            self._small = cv.resize(frame, size, dst=self._small, interpolation=cv.INTER_AREA)
+            frame = self._small
+
+        start = time.perf_counter()
+        results = self.pose.process(frame)
+        self.controller.record(self.camera_index, time.perf_counter() - start)
+        return results
@@ -0,0 +1,228 @@
+import queue
+import threading
+import time
+import numpy as np
+from utils import detect_keypoints, triangulate_points
+from camera_workers import FrameBuffers
+
+
+class StageStats:
+
+    """Counters of one pipeline stage.
+
+    busy is the time spent doing work, starved the time spent waiting for input and blocked the time spent
+    waiting for room in the output queue (backpressure). The stage with the most busy time and the least
+    starved time is the one limiting throughput.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.processed = 0
+        self.busy = 0.0
+        self.starved = 0.0
+        self.blocked = 0.0
+        self.max_queue_depth = 0
+
+    def as_dict(self):
+        return {'processed': self.processed, 'busy_s': self.busy, 'starved_s': self.starved,
+                'blocked_s': self.blocked, 'max_queue_depth': self.max_queue_depth}
+
+
+class _Stage(threading.Thread):
+
+    # runs work(item) on every item of input_queue and puts the result into output_queue.
+    # A stage without input_queue is a source, work(None) produces items until it returns None.
+    # None is passed downstream to signal the end of the stream.
+
+    def __init__(self, name, work, input_queue, output_queue, stop_event):
+        super().__init__(name=name, daemon=True)
+        self.work = work
+        self.input_queue = input_queue
+        self.output_queue = output_queue
+        self.stop_event = stop_event
+        self.stats = StageStats(name)
+        self.error = None
+
+    def run(self):
+        try:
+            self._run()
+        except Exception as error:
+            # handed to the consumer, which re-raises it
+            self.error = error
+            self.stop_event.set()
+        finally:
+            self._put_end()
+
+    def _run(self):
+        while not self.stop_event.is_set():
+            item = None
+            if self.input_queue is not None:
+                start = time.perf_counter()
+                item = self._get()
+                self.stats.starved += time.perf_counter() - start
+                if item is None:
+                    break
+
+            start = time.perf_counter()
+            result = self.work(item)
+            self.stats.busy += time.perf_counter() - start
+            if result is None:
+                break
+
+            start = time.perf_counter()
+            if not self._put(result):
+                return
+            self.stats.blocked += time.perf_counter() - start
+            self.stats.processed += 1
+            self.stats.max_queue_depth = max(self.stats.max_queue_depth, self.output_queue.qsize())
+
+    def _put_end(self):
+        if self._put(None):
+            return
+        # stopped: the end marker must still arrive, drop a queued item if the consumer left the queue full
+        while True:
+            try:
+                self.output_queue.put_nowait(None)
+                return
+            except queue.Full:
+                try:
+                    self.output_queue.get_nowait()
+                except queue.Empty:
+                    pass
+
+    def _get(self):
+        while not self.stop_event.is_set():
+            try:
+                return self.input_queue.get(timeout=0.1)
+            except queue.Empty:
+                continue
+        return None
+
+    def _put(self, item):
+        # bounded put that gives up once the pipeline is stopped, so a full queue never blocks shutdown
+        while not self.stop_event.is_set():
+            try:
+                self.output_queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+
+class Pipeline:
+
+    """Staged decode -> infer -> triangulate pipeline connected by bounded queues.
+
+    Every stage runs in its own thread, so decoding frame t+1 overlaps inference on frame t and
+    triangulation of frame t-1. Iterating over the pipeline is the last (write) stage and yields
+    (frames, keypoints, valid, p3ds) per frame index in order. Full queues block the upstream stage,
+    so memory stays bounded by queue_size frames per stage.
+
+    Example:
+        pipeline = Pipeline(caps, poses, pose_keypoints, rig, headless=True)
+        for frames, keypoints, valid, p3ds in pipeline:
+            sink.append(keypoints, p3ds)
+        pipeline.print_stats()
+    """
+
+    def __init__(self, caps, poses, pose_keypoints, rig, headless=False, queue_size=4):
+        self.caps = caps
+        self.poses = poses
+        self.pose_keypoints = pose_keypoints
+        self.rig = rig
+        self.headless = headless
+
+        # every frame in a queue or held by a stage needs its own buffer
+        self._buffers = [FrameBuffers(size=3 * queue_size + 4) for _ in caps]
+
+        self._stop_event = threading.Event()
+        self._queues = [queue.Queue(maxsize=queue_size) for _ in range(3)]
+        self._stages = [_Stage('decode', self._decode, None, self._queues[0], self._stop_event),
+                        _Stage('infer', self._infer, self._queues[0], self._queues[1], self._stop_event),
+                        _Stage('triangulate', self._triangulate, self._queues[1], self._queues[2], self._stop_event)]
+        self._write_stats = StageStats('write')
+        self._started = False
+
+    def _decode(self, _):
+        frames = []
+        frames_rgb = []
+        for cap, buffers in zip(self.caps, self._buffers):
+            ret, frame, frame_rgb = buffers.read(cap)
+            if not ret:
+                return None  # End of video reached
+            frames.append(frame)
+            frames_rgb.append(frame_rgb)
+        return frames, frames_rgb
+
+    def _infer(self, item):
+        frames, frames_rgb = item
+        keypoints = []
+        valid = []
+        for pose, frame, frame_rgb in zip(self.poses, frames, frames_rgb):
+            frame_rgb.flags.writeable = False
+            result = pose.process(frame_rgb)
+            frame_rgb.flags.writeable = True
+            frame_keypoints, frame_visibility, frame_valid = detect_keypoints(frame, result, self.pose_keypoints, draw=not self.headless)
+            keypoints.append(frame_keypoints)
+            valid.append(frame_valid)
+        return frames, np.stack(keypoints), np.stack(valid)
+
+    def _triangulate(self, item):
+        frames, keypoints, valid = item
+        p3ds = triangulate_points(self.rig, keypoints.transpose(1, 0, 2), valid.T)
+        return frames, keypoints, valid, p3ds
+
+    def __iter__(self):
+        if not self._started:
+            for stage in self._stages:
+                stage.start()
+            self._started = True
+
+        output_queue = self._queues[-1]
+        try:
+            while True:
+                start = time.perf_counter()
+                item = output_queue.get()
+                self._write_stats.starved += time.perf_counter() - start
+                if item is None:
+                    break
+
+                start = time.perf_counter()
+                yield item
+                self._write_stats.busy += time.perf_counter() - start
+                self._write_stats.processed += 1
+        finally:
+            self.close()
+
+        for stage in self._stages:
+            if stage.error is not None:
+                raise stage.error
+
+    def close(self):
+        self._stop_event.set()
+        for stage in self._stages:
+            if stage.is_alive():
+                stage.join()
+
+    def stats(self):
+
+        """Per stage counters and the current queue depths, e.g. {'decode': {...}, 'infer': {...}, ...}."""
+
+        stats = {}
+        for stage, stage_queue in zip(self._stages, self._queues):
+            stats[stage.name] = stage.stats.as_dict()
+            stats[stage.name]['queue_depth'] = stage_queue.qsize()
+        stats['write'] = self._write_stats.as_dict()
+        return stats
+
+    def bottleneck(self):
+        # the stage that spent the most time working is the one the others wait for
+        stats = self.stats()
+        return max(stats, key=lambda name: stats[name]['busy_s'])
+
+    def print_stats(self):
+        print('stage        frames   busy [s]  starved [s]  blocked [s]  max queue')
+        for name, stage_stats in self.stats().items():
+            print(f"{name:<12} {stage_stats['processed']:>6} {stage_stats['busy_s']:>10.2f} {stage_stats['starved_s']:>12.2f} "
+                  f"{stage_stats['blocked_s']:>12.2f} {stage_stats['max_queue_depth']:>10}")
+        print('bottleneck:', self.bottleneck())
@@ -1,14 +1,71 @@
+import os
 import cv2 as cv
 import mediapipe as mp
 import numpy as np
-from utils import detect_keypoints, DLT
-
-def run_mp(input_stream_dict=None):
-
+from utils import triangulate_points, CameraRig
+from camera_workers import read_frames_serial, read_frames_parallel
+from pipeline import Pipeline
+from process_inference import read_frames_processes
+from frame_sync import FrameSynchronizer, read_frames_synchronized
+from inference_input import InferenceInput
+from latency_controller import AdaptivePose, LatencyController
+from view_scheduler import ViewScheduler, read_frames_scheduled
+from refinement import refine_session
+from keyframe_tracking import KeyframeTracker, print_keyframe_stats, read_frames_keyframes
+from detection_cache import CachedPose, pose_settings_key, video_fingerprint
+
+
+def show_preview(frames, scale=0.25):
+    # cheap preview for headless mode, frames are the BGR captures without any drawing
+    for i, frame in enumerate(frames):
+        if frame is None:
+            continue
+        cv.imshow(f"cam{i}", cv.resize(frame, None, fx=scale, fy=scale, interpolation=cv.INTER_NEAREST))
+
+
+def run_mp(input_stream_dict=None, rig=None, backend='serial', headless=False, preview_every=0, sink=None, cache=None,
+           inference_size=None, roi=False, frame_budget=None, active_cameras=None,
+           refine=False, camera_timeout=10.0):
+
+    # input_stream_dict maps each input stream to its projection matrix. If a CameraRig is given,
+    # input_stream_dict can simply list the streams in the camera order of the rig.
+    # backend='threads' runs decode and inference of each camera in its own worker thread.
+    # backend='pipeline' runs decode, inference and triangulation as concurrent stages connected by
+    # bounded queues and prints the per stage counters at the end.
+    # backend='processes' runs inference in a pool of processes fed through shared memory frame rings,
+    # each process owns its own Pose objects (detections are not cached with this backend).
+    # backend='sync' is meant for live cameras: frames are paired by capture timestamp, stale frames are
+    # dropped and a camera without a frame in time is skipped for that frame set instead of stopping the run.
+    # A camera is only given up once its reads kept failing for camera_timeout seconds (None retries forever).
+    # backend='keyframes' runs detection only on keyframes and tracks the keypoints with optical flow in
+    # between, the stride adapts to the motion and the speedup and drift are printed at the end.
+    # headless=True skips drawing and all GUI calls. With preview_every=N
+    # a downscaled preview is still shown every N frames (frames 0, N, 2N, ...).
+    # With a sink (e.g. KeypointStreamWriter) every frame is streamed to it instead of being kept in memory,
+    # the returned array then only holds the frames still in the sink's ring buffer.
+    # With a DetectionCache, detections of video files are read from the cache and only missing frames are inferred
+    # (not with the 'processes', 'sync' and 'keyframes' backends, roi=True, frame_budget or active_cameras).
+    # With inference_size (serial and threads backends) the frames are downscaled so that their longer side is at most
+    # inference_size pixels before Pose.process, roi=True also crops them around the keypoints of the previous frame.
+    # Keypoints are always returned in full resolution pixels.
+    # With frame_budget (seconds of inference per frame) a LatencyController switches model_complexity, inference
+    # resolution and thresholds of the Pose objects to stay within the budget and logs every switch.
+    # With active_cameras (serial backend) a ViewScheduler detects only that many cameras per frame once the 3D pose
+    # is confident, the reprojected predicted pose stands in for the others.
+    # refine=True refines the returned 3D keypoints of the whole session by minimizing their reprojection error
+    # (without a sink, use retriangulate.py --refine on the written files otherwise).
     if input_stream_dict is None:
         raise ValueError("input_stream_dict cannot be None.")
+    if refine and sink is not None:
+        raise ValueError("refine needs the keypoints in memory and cannot be used with a sink, run retriangulate.py --refine on the written files instead.")
     
     num_cameras = len(input_stream_dict)
+
+    # projection data is built once, the frame loop only consumes the rig
+    if rig is None:
+        rig = CameraRig.from_projection_matrices(list(input_stream_dict.values()))
+    if len(rig) != num_cameras:
+        raise ValueError("rig and input_stream_dict must have the same number of cameras.")
     
     # mediapipe related inits
     mp_drawing = mp.solutions.drawing_utils
@@ -16,16 +73,17 @@ def run_mp(input_stream_dict=None):
     mp_pose = mp.solutions.pose
     
     # add here if you need more keypoints
-    pose_keypoints = [16, 14, 12, 11, 13, 15, 24, 23, 25, 26, 27, 28]
+    # index array into the 33 mediapipe landmarks, precomputed once
+    pose_keypoints = np.array([16, 14, 12, 11, 13, 15, 24, 23, 25, 26, 27, 28])
     
     # input video streams
     caps = []
-    for input_stream in input_stream_dict.keys():
+    for input_stream in input_stream_dict:
         cap = cv.VideoCapture(input_stream)
         caps.append(cap)
 
     # set camera resolution if using webcam to 1280x720. Any bigger will cause some lag for hand detection
-    for cap in caps:
+    for i, cap in enumerate(caps):
         # Get the width and height of the video capture
         width = int(cap.get(cv.CAP_PROP_FRAME_WIDTH))
         height = int(cap.get(cv.CAP_PROP_FRAME_HEIGHT))
@@ -33,9 +91,35 @@ def run_mp(input_stream_dict=None):
         # Set the resolution of the video source to its native resolution
         cap.set(cv.CAP_PROP_FRAME_WIDTH, width)
         cap.set(cv.CAP_PROP_FRAME_HEIGHT, height)
+        rig.image_sizes[i] = (width, height)
 
     # create body keypoints detector objects.
-    poses = [mp_pose.Pose(min_detection_confidence=0.85, min_tracking_confidence=0.85) for _ in range(num_cameras)]
+    pose_settings = dict(min_detection_confidence=0.85, min_tracking_confidence=0.85)
+    controller = None
+    if backend == 'processes':
+        # the Pose objects live in the inference processes
+        if frame_budget is not None:
+            raise ValueError("frame_budget is not supported by the 'processes' backend.")
+        poses = []
+    elif frame_budget is not None:
+        # only the threads backend runs the cameras' Pose.process calls concurrently, the pipeline's
+        # inference stage runs them one after another
+        controller = LatencyController(frame_budget, concurrent=(backend == 'threads'))
+        poses = [AdaptivePose(controller, i) for i in range(num_cameras)]
+    else:
+        poses = [mp_pose.Pose(**pose_settings) for _ in range(num_cameras)]
+
+    # answer from the detection cache where possible, live camera streams are never cached
+    # the cache counts frames per Pose.process call, which does not hold when frames are skipped
+    # (keyframes, stale frames dropped by sync, view scheduler), and its key assumes fixed pose settings. Downscaled
+    # detections are cached under their inference_size, ROI crops depend on the previous frame's keypoints and are never cached
+    if cache is not None and backend not in ('processes', 'sync', 'keyframes') and controller is None and active_cameras is None and not roi:
+        if inference_size is not None:
+            settings_key = pose_settings_key(inference_size=inference_size, **pose_settings)
+        else:
+            settings_key = pose_settings_key(**pose_settings)
+        poses = [CachedPose(pose, cache, video_fingerprint(input_stream), settings_key) if isinstance(input_stream, str) and os.path.isfile(input_stream) else pose
+                 for pose, input_stream in zip(poses, input_stream_dict)]
 
     # containers for detected keypoints for each camera. These are filled at each frame.
     # This will run you into a memory issue if you run the program without stopping it.
@@ -43,69 +127,108 @@ def run_mp(input_stream_dict=None):
     keypoints = [[] for _ in range(num_cameras)]
     kpts_3d = []
     
-    while True:
-        # read frames from streams
-        frames = []
-        ret_frames = []
-        for i, cap in enumerate(caps):
-            ret, frame = cap.read()
-            ret_frames.append(ret)
-            if not ret:
-                break  # End of video reached, break out of the loop
-            frames.append(cv.cvtColor(frame, cv.COLOR_BGR2RGB))
-            frames[-1].flags.writeable = False  # To improve performance, optionally mark the image as not writeable to pass by reference.
-
-        if not all(ret_frames):
-            break
-
-        results = [pose.process(frame) for pose, frame in zip(poses, frames)]
-
-        # Reverse changes
-        for frame in frames:
-            frame.flags.writeable = True
-
-        frames = [cv.cvtColor(frame, cv.COLOR_RGB2BGR) for frame in frames]
-
-        # Detect keypoints and keep keypoints of the frame in memory
-        temp = []
-        for i, (pose, result) in enumerate(zip(poses, results)):
-            keypoints_frame = detect_keypoints(frames[i], result, pose_keypoints)
-            #print(keypoints_frame)
-            keypoints[i].append(keypoints_frame)
-            temp.append(keypoints_frame)
-
-        #Calculate 3d position
-        frame_p3ds = []
-        coords = [tuple(keypoints) for keypoints in zip(*temp)]
-        for uv_coords in coords:
-            #at least two of them are different than [-1,-1], we need at least two points to do triangulation
-            count_non_negative_ones = sum(1 for lst in uv_coords if lst != [-1, -1])
-            if count_non_negative_ones < 2 :
-                _p3d = [-1, -1, -1]
-            else:
-                #Get the projection matrices
-                projection_matrices = [value for value in input_stream_dict.values()]
-                _p3d = DLT(projection_matrices, uv_coords)
-            frame_p3ds.append(_p3d)
+    # read and process the frames of all cameras: one camera after another, with one worker per camera,
+    # as a staged pipeline, with inference in separate processes, synchronized by timestamp or on keyframes only
+    inference_inputs = None
+    if inference_size is not None or roi:
+        if backend not in ('serial', 'threads'):
+            raise ValueError("inference_size and roi are supported by the 'serial' and 'threads' backends.")
+        inference_inputs = [InferenceInput(inference_size, roi) for _ in range(num_cameras)]
+
+    scheduler = None
+    if active_cameras is not None:
+        if backend != 'serial':
+            raise ValueError("active_cameras is supported by the 'serial' backend.")
+        scheduler = ViewScheduler(rig, active_cameras)
+        frame_source = read_frames_scheduled(caps, poses, pose_keypoints, scheduler, headless, inference_inputs)
+    elif backend == 'serial':
+        frame_source = read_frames_serial(caps, poses, pose_keypoints, headless, inference_inputs)
+    elif backend == 'threads':
+        frame_source = read_frames_parallel(caps, poses, pose_keypoints, headless, inference_inputs=inference_inputs)
+    elif backend == 'pipeline':
+        pipeline = Pipeline(caps, poses, pose_keypoints, rig, headless)
+        frame_source = iter(pipeline)
+    elif backend == 'processes':
+        frame_source = read_frames_processes(caps, pose_settings, pose_keypoints, headless)
+    elif backend == 'sync':
+        synchronizer = FrameSynchronizer(caps, give_up_after=camera_timeout)
+        frame_source = read_frames_synchronized(caps, poses, pose_keypoints, headless, synchronizer=synchronizer)
+    elif backend == 'keyframes':
+        trackers = [KeyframeTracker(pose, pose_keypoints) for pose in poses]
+        frame_source = read_frames_keyframes(caps, trackers, headless)
+    else:
+        raise ValueError(f"Unknown backend {backend}, expected 'serial', 'threads', 'pipeline', 'processes', 'sync' or 'keyframes'.")
+
+    for frame_index, item in enumerate(frame_source):
+        if backend == 'pipeline' or scheduler is not None:
+            # the pipeline and the scheduler already triangulated the frame
+            frames, frame_keypoints, frame_valid, frame_p3ds = item
+        else:
+            frames, frame_keypoints, frame_valid = item
+
+            #Calculate 3d position of all keypoints in one batched call, (K, C, 2) -> (K, 3)
+            #at least two cameras with a valid detection are needed to do triangulation
+            frame_p3ds = triangulate_points(rig, frame_keypoints.transpose(1, 0, 2), frame_valid.T)
+
+        # keep keypoints of the frame in memory
+        if sink is None:
+            for i, keypoints_frame in enumerate(frame_keypoints):
+                keypoints[i].append(keypoints_frame)
 
         '''
         This contains the 3d position of each keypoint in the current frame.
         For real-time applications, this is what you want.
         '''
         frame_p3ds = np.array(frame_p3ds).reshape((-1, 3))
-        kpts_3d.append(frame_p3ds)
+        if sink is None:
+            kpts_3d.append(frame_p3ds)
+        else:
+            sink.append(frame_keypoints, frame_p3ds)
+
+        if headless:
+            if preview_every and frame_index % preview_every == 0:
+                show_preview(frames)
+                if cv.waitKey(1) & 0xFF == 27:
+                    break
+            continue
 
         for i, frame in enumerate(frames):
-            cv.imshow(f"cam{i}", frame)
+            if frame is not None:
+                cv.imshow(f"cam{i}", frame)
 
         k = cv.waitKey(1)
         if k & 0xFF == 27:
             break  # 27 is the ESC key.
 
-    cv.destroyAllWindows()
+    frame_source.close()
+    if backend == 'pipeline':
+        pipeline.print_stats()
+    elif backend == 'sync':
+        synchronizer.print_stats()
+    elif backend == 'keyframes':
+        print_keyframe_stats(trackers)
+    if controller is not None:
+        controller.print_summary()
+    if scheduler is not None:
+        scheduler.print_stats()
+    if not headless or preview_every:
+        cv.destroyAllWindows()
     for cap in caps:
         cap.release()
 
+    if cache is not None:
+        cache.flush()
+
+    if sink is not None:
+        sink.flush()
+        return sink.latest_3d(sink.frame_count)
+
+    kpts_3d = np.array(kpts_3d)
+    if refine and len(kpts_3d):
+        # (C, F, K, 2) -> (F, K, C, 2)
+        kpts_2d = np.stack([np.array(kpts) for kpts in keypoints], axis=2)
+        kpts_3d, residuals = refine_session(rig, kpts_3d, kpts_2d)
+
     #return [np.array(kpts) for kpts in keypoints], np.array(kpts_3d)
-    return np.array(kpts_3d)
+    return kpts_3d
 
@@ -0,0 +1,183 @@
+import multiprocessing
+import queue
+import traceback
+from multiprocessing import shared_memory
+import cv2 as cv
+import numpy as np
+from utils import detect_keypoints, draw_keypoints
+
+
+class SharedFrameRing:
+
+    """Ring of frame slots of one camera in shared memory.
+
+    The decoder reads frames straight into a slot and inference processes attach to the same memory by
+    name, so no pixel data is ever pickled. Only (slot, frame_index) travels through the task queues.
+    """
+
+    def __init__(self, frame_shape, num_slots, name=None):
+        self.frame_shape = tuple(frame_shape)
+        self.num_slots = num_slots
+        size = num_slots * int(np.prod(self.frame_shape))
+        self.owner = name is None
+        self.shm = shared_memory.SharedMemory(name=name, create=self.owner, size=size if self.owner else 0)
+        self.slots = np.ndarray((num_slots,) + self.frame_shape, dtype=np.uint8, buffer=self.shm.buf)
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    def close(self):
+        del self.slots
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+def _inference_worker(camera_indices, ring_specs, pose_settings, pose_keypoints, task_queue, result_queue):
+    # runs in its own process and owns one mp_pose.Pose for every camera pinned to it, so each Pose
+    # sees the frames of its camera in order and mediapipe's tracking keeps working
+    import mediapipe as mp
+
+    rings = {}
+    try:
+        poses = {i: mp.solutions.pose.Pose(**pose_settings) for i in camera_indices}
+        rings = {i: SharedFrameRing(ring_specs[i][1], ring_specs[i][2], name=ring_specs[i][0]) for i in camera_indices}
+        frames_rgb = {i: np.empty(ring_specs[i][1], dtype=np.uint8) for i in camera_indices}
+
+        while True:
+            task = task_queue.get()
+            if task is None:
+                break
+            camera_index, slot, frame_index = task
+
+            frame_rgb = cv.cvtColor(rings[camera_index].slots[slot], cv.COLOR_BGR2RGB, dst=frames_rgb[camera_index])
+            frame_rgb.flags.writeable = False
+            result = poses[camera_index].process(frame_rgb)
+            frame_rgb.flags.writeable = True
+
+            # only the compact keypoint arrays are sent back
+            keypoints, visibility, valid = detect_keypoints(frame_rgb, result, pose_keypoints, draw=False)
+            result_queue.put((camera_index, frame_index, keypoints.copy(), valid))
+    except Exception:
+        result_queue.put(('error', traceback.format_exc()))
+    finally:
+        for ring in rings.values():
+            ring.close()
+
+
+def read_frames_processes(caps, pose_settings, pose_keypoints, headless=False, num_workers=None, ring_size=8, poll_interval=1.0):
+
+    """Yield (frames, keypoints, valid) of every frame index, running inference in a pool of processes.
+
+    Decoded frames are placed in per camera shared memory rings and consumed by inference processes
+    without pickling pixel data, which sidesteps the GIL held by mediapipe's bindings and the post-processing.
+    Cameras are pinned to workers (camera i goes to worker i % num_workers), each worker owning its own
+    mp_pose.Pose per camera. Up to ring_size - 1 frames per camera are in flight at once.
+
+    Args:
+        caps (list): opened cv.VideoCapture of every camera.
+        pose_settings (dict): keyword arguments of mp_pose.Pose.
+        pose_keypoints (numpy.ndarray): index array of the landmarks to keep.
+        headless (bool, optional): skip drawing the keypoints into the frames. Default is False.
+        num_workers (int, optional): inference processes, default is one per camera.
+        ring_size (int, optional): frame slots per camera. Default is 8.
+        poll_interval (float, optional): seconds between checks that the workers are still alive while waiting
+            for results, a worker that died without reporting an error raises a RuntimeError. Default is 1.0.
+    """
+
+    num_cameras = len(caps)
+    num_workers = min(num_workers or num_cameras, num_cameras)
+
+    # the first frames tell the frame size of each camera
+    first_frames = []
+    for cap in caps:
+        ret, frame = cap.read()
+        if not ret:
+            return
+        first_frames.append(frame)
+
+    rings = [SharedFrameRing(frame.shape, ring_size) for frame in first_frames]
+    for ring, frame in zip(rings, first_frames):
+        ring.slots[0] = frame
+    ring_specs = [(ring.name, ring.frame_shape, ring.num_slots) for ring in rings]
+
+    context = multiprocessing.get_context('spawn')
+    result_queue = context.Queue()
+    task_queues = [context.Queue() for _ in range(num_workers)]
+    workers = []
+    for w in range(num_workers):
+        camera_indices = list(range(w, num_cameras, num_workers))
+        worker = context.Process(target=_inference_worker, daemon=True,
+                                 args=(camera_indices, ring_specs, pose_settings, np.asarray(pose_keypoints), task_queues[w], result_queue))
+        worker.start()
+        workers.append(worker)
+
+    def submit(frame_index):
+        slot = frame_index % ring_size
+        for i in range(num_cameras):
+            task_queues[i % num_workers].put((i, slot, frame_index))
+
+    try:
+        # per frame index: camera -> (keypoints, valid)
+        pending = {}
+        submit(0)
+        submitted = 1
+        next_frame = 0
+        stream_ended = False
+
+        while next_frame < submitted:
+            # keep the ring full: at most ring_size - 1 frames in flight besides the one being consumed
+            while not stream_ended and submitted - next_frame < ring_size - 1:
+                slot = submitted % ring_size
+                for i, (cap, ring) in enumerate(zip(caps, rings)):
+                    slot_frame = ring.slots[slot]
+                    ret, frame = cap.read(slot_frame)
+                    if not ret:
+                        stream_ended = True  # End of video reached
+                        break
+                    if frame is not slot_frame:
+                        # OpenCV allocated a new array instead of decoding into the shared slot
+                        if frame.shape != slot_frame.shape:
+                            raise RuntimeError(f'Frame size of camera {i} changed from {slot_frame.shape} to {frame.shape}.')
+                        np.copyto(slot_frame, frame)
+                if stream_ended:
+                    break
+                submit(submitted)
+                submitted += 1
+
+            # gather the results of the next frame index
+            while len(pending.get(next_frame, {})) < num_cameras:
+                try:
+                    result = result_queue.get(timeout=poll_interval)
+                except queue.Empty:
+                    # a worker killed by a crash or the OOM killer never reports back
+                    dead = [(w, worker.exitcode) for w, worker in enumerate(workers) if not worker.is_alive()]
+                    if dead:
+                        raise RuntimeError(f'Inference worker {dead[0][0]} exited unexpectedly with exit code {dead[0][1]}.')
+                    continue
+                if result[0] == 'error':
+                    raise RuntimeError('Inference worker failed:\n' + result[1])
+                camera_index, frame_index, keypoints, valid = result
+                pending.setdefault(frame_index, {})[camera_index] = (keypoints, valid)
+
+            frame_results = pending.pop(next_frame)
+            slot = next_frame % ring_size
+            frames = [ring.slots[slot] for ring in rings]
+            keypoints = np.stack([frame_results[i][0] for i in range(num_cameras)])
+            valid = np.stack([frame_results[i][1] for i in range(num_cameras)])
+            if not headless:
+                for frame, frame_keypoints, frame_valid in zip(frames, keypoints, valid):
+                    draw_keypoints(frame, frame_keypoints, frame_valid)
+
+            yield frames, keypoints, valid
+            next_frame += 1
+    finally:
+        for task_queue in task_queues:
+            task_queue.put(None)
+        for worker in workers:
+            worker.join(timeout=5)
+            if worker.is_alive():
+                worker.terminate()
+        for ring in rings:
+            ring.close()
@@ -0,0 +1,125 @@
+import time
+import numpy as np
+
+
+def _project(rows, points_3d):
+    # ideal pinhole projection of (..., 3) points into every camera, returns (..., C, 2) pixels and (..., C) depths
+    P0, P1, P2 = rows
+    Xh = np.concatenate([points_3d, np.ones(points_3d.shape[:-1] + (1,))], axis=-1)[..., np.newaxis, :]
+    w = np.sum(Xh * P2, axis=-1)
+    uv = np.stack([np.sum(Xh * P0, axis=-1) / w, np.sum(Xh * P1, axis=-1) / w], axis=-1)
+    return uv, w
+
+
+def _residuals(rows, points_3d, observations, visibility):
+    uv, w = _project(rows, points_3d)
+    residuals = (uv - observations) * visibility[..., np.newaxis]
+    return residuals, uv, w
+
+
+def refine_points(rig, points_3d, points_2d, visibility=None, iterations=10, damping=1e-3, tolerance=1e-6):
+
+    """Refine triangulated points by minimizing their reprojection error with a batched Levenberg-Marquardt solver.
+
+    Every point only depends on its own 3 coordinates, so the normal equations are block diagonal: one 3x3
+    system per point, built and solved for all points of all frames at once with a few NumPy operations.
+    Each point has its own damping, a step is only kept if it lowers that point's error.
+
+    Args:
+        rig (CameraRig): calibration of the cameras.
+        points_3d (numpy.ndarray): (..., K, 3) triangulated points, -1 for points that could not be triangulated.
+        points_2d (numpy.ndarray): (..., K, C, 2) pixel observations, laid out as for triangulate_points.
+        visibility (numpy.ndarray, optional): (..., K, C) mask, observations equal to [-1, -1] are missing if omitted.
+        iterations (int, optional): maximum number of iterations. Default is 10.
+        damping (float, optional): initial damping factor. Default is 1e-3.
+        tolerance (float, optional): stop once no proposed step, accepted or not, changes a point by more than this.
+            Default is 1e-6.
+
+    Returns:
+        tuple: (refined, residuals). refined has the shape of points_3d, points that were not triangulated
+        stay -1. residuals holds the (..., K) RMS reprojection error in pixels per point, -1 where undefined.
+    """
+
+    points_2d = np.asarray(points_2d, dtype=np.float64)
+    if visibility is None:
+        visibility = np.any(points_2d != -1, axis=-1)
+    visibility = np.asarray(visibility, dtype=bool)
+
+    # the solver works on ideal pinhole pixels, lens distortion is removed from the observations once
+    observations = rig.undistort(points_2d, visibility)
+    rows = rig.rows
+
+    X = np.array(points_3d, dtype=np.float64)
+    solvable = ~np.all(X == -1, axis=-1) & (visibility.sum(axis=-1) >= 2)
+    weights = (visibility & solvable[..., np.newaxis]).astype(np.float64)
+
+    residuals, uv, w = _residuals(rows, X, observations, weights)
+    cost = np.sum(residuals ** 2, axis=(-2, -1))
+    lam = np.full(cost.shape, damping)
+
+    for _ in range(iterations):
+        # d(u, v) / dX of every observation, (..., K, C, 2, 3)
+        J = np.stack([(rows[0][:, :3] - uv[..., 0:1] * rows[2][:, :3]) / w[..., np.newaxis],
+                      (rows[1][:, :3] - uv[..., 1:2] * rows[2][:, :3]) / w[..., np.newaxis]], axis=-2)
+        J *= weights[..., np.newaxis, np.newaxis]
+
+        # per point 3x3 normal equations
+        JtJ = np.einsum('...cri,...crj->...ij', J, J)
+        Jtr = np.einsum('...cri,...cr->...i', J, residuals)
+        A = JtJ + lam[..., np.newaxis, np.newaxis] * (JtJ * np.eye(3))
+        A[~solvable] = np.eye(3)
+        Jtr[~solvable] = 0
+        step = -np.linalg.solve(A, Jtr[..., np.newaxis])[..., 0]
+
+        X_new = X + step
+        residuals_new, uv_new, w_new = _residuals(rows, X_new, observations, weights)
+        cost_new = np.sum(residuals_new ** 2, axis=(-2, -1))
+
+        # keep improving steps and relax their damping, tighten it for the others
+        better = solvable & (cost_new < cost) & np.all(w_new > 0, axis=-1)
+        X[better] = X_new[better]
+        residuals[better] = residuals_new[better]
+        uv[better] = uv_new[better]
+        w[better] = w_new[better]
+        cost[better] = cost_new[better]
+        lam = np.where(better, lam * 0.1, lam * 10)
+
+        # rejected steps are retried with the raised damping until they shrink below the tolerance as well
+        converged = np.all(np.abs(step) <= tolerance, axis=-1)
+        if np.all(converged[solvable]):
+            break
+
+    X[~solvable] = -1
+    rms = np.full(cost.shape, -1.0)
+    rms[solvable] = np.sqrt(cost[solvable] / weights.sum(axis=-1)[solvable])
+    return X, rms
+
+
+def reprojection_residuals(rig, points_3d, points_2d, visibility=None):
+
+    """(..., K) RMS reprojection error in pixels of every point, -1 where it is undefined."""
+
+    refined, residuals = refine_points(rig, points_3d, points_2d, visibility, iterations=0)
+    return residuals
+
+
+def print_refinement_report(residuals_before, residuals_after, seconds):
+    before = residuals_before[residuals_before >= 0]
+    after = residuals_after[residuals_after >= 0]
+    if len(after) == 0:
+        print('refinement: no triangulated points')
+        return
+    print(f'refinement of {len(after)} points in {seconds:.2f} s: '
+          f'mean reprojection error {before.mean():.2f} -> {after.mean():.2f} px, '
+          f'p95 {np.percentile(before, 95):.2f} -> {np.percentile(after, 95):.2f} px')
+
+
+def refine_session(rig, kpts_3d, kpts_2d, visibility=None, **kwargs):
+
+    """Refine the (F, K, 3) keypoints of a whole session against its (F, K, C, 2) observations and print a report."""
+
+    start = time.perf_counter()
+    residuals_before = reprojection_residuals(rig, kpts_3d, kpts_2d, visibility)
+    refined, residuals = refine_points(rig, kpts_3d, kpts_2d, visibility, **kwargs)
+    print_refinement_report(residuals_before, residuals, time.perf_counter() - start)
+    return refined, residuals
@@ -0,0 +1,119 @@
+import argparse
+import collections
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from utils import CameraRig, triangulate_points
+from refinement import print_refinement_report, refine_points, reprojection_residuals
+from keypoint_io import BINARY_EXTENSION, BinaryKeypointWriter, append_keypoints_text, is_binary_keypoint_file, read_keypoints_binary, read_keypoints_text
+
+
+def load_camera_keypoints(filename, num_keypoints=12):
+
+    """Load the 2D keypoints of one camera, (frames, keypoints, 2). Binary files are memory mapped."""
+
+    if is_binary_keypoint_file(filename):
+        return read_keypoints_binary(filename)
+    return read_keypoints_text(filename, num_keypoints=num_keypoints)
+
+
+def _triangulate_chunk(rig, camera_chunks, refine=False):
+    # (C, F, K, 2) -> (F, K, C, 2)
+    points = np.stack(camera_chunks, axis=2)
+    p3ds = triangulate_points(rig, points)
+    if not refine:
+        return p3ds, None, None
+    residuals_before = reprojection_residuals(rig, p3ds, points)
+    p3ds, residuals = refine_points(rig, p3ds, points)
+    return p3ds, residuals_before, residuals
+
+
+def retriangulate_session(kpts_2d_paths, rig, output_path='kpts_3d.dat', num_keypoints=12, chunk_frames=5000, processes=None, refine=False):
+
+    """Recompute the 3D keypoints of a recorded session from its saved 2D keypoint files.
+
+    No inference is needed, so after a recalibration a whole session is re-triangulated in seconds.
+    The frames are split in chunks of chunk_frames that are triangulated across a process pool and
+    written in frame order.
+
+    Args:
+        kpts_2d_paths (list): per camera 2D keypoint files (text .dat or binary .kpts), in the camera order of the rig.
+        rig (CameraRig): calibration of the cameras.
+        output_path (str, optional): output file, written as binary if it ends with .kpts. Default is 'kpts_3d.dat'.
+        num_keypoints (int, optional): keypoints per frame of text input files. Default is 12.
+        chunk_frames (int, optional): frames per chunk sent to a worker process. Default is 5000.
+        processes (int, optional): number of worker processes, None uses every core.
+        refine (bool, optional): refine the DLT points by minimizing their reprojection error and print
+            the residuals before and after. Default is False.
+
+    Returns:
+        int: number of triangulated frames.
+
+    Example:
+        rig = CameraRig.from_parameter_files('parameters/camera_parameters', ['cam_0', 'cam_1', 'cam_2'])
+        retriangulate_session(['kpts_cam0.dat', 'kpts_cam1.dat', 'kpts_cam2.dat'], rig, 'kpts_3d.dat')
+    """
+
+    if len(kpts_2d_paths) != len(rig):
+        raise ValueError("One 2D keypoint file per camera of the rig is needed.")
+
+    cameras = [load_camera_keypoints(path, num_keypoints) for path in kpts_2d_paths]
+    num_frames = min(len(kpts) for kpts in cameras)
+    num_keypoints = cameras[0].shape[1]
+
+    if output_path.endswith(BINARY_EXTENSION):
+        fout = BinaryKeypointWriter(output_path, num_keypoints, 3)
+    else:
+        fout = open(output_path, 'w')
+
+    residuals_before = []
+    residuals_after = []
+    start_time = time.perf_counter()
+
+    def write_chunk(result):
+        p3ds, before, after = result
+        if refine:
+            residuals_before.append(before.ravel())
+            residuals_after.append(after.ravel())
+        if isinstance(fout, BinaryKeypointWriter):
+            fout.append(p3ds)
+        else:
+            append_keypoints_text(fout, p3ds)
+
+    # only a bounded number of chunks is in flight, memory mapped input is read when its chunk is submitted
+    max_in_flight = 2 * (processes or os.cpu_count() or 1)
+    pending = collections.deque()
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        for start in range(0, num_frames, chunk_frames):
+            stop = min(start + chunk_frames, num_frames)
+            camera_chunks = [np.asarray(kpts[start:stop]) for kpts in cameras]
+            pending.append(executor.submit(_triangulate_chunk, rig, camera_chunks, refine))
+            if len(pending) >= max_in_flight:
+                write_chunk(pending.popleft().result())
+
+        while pending:
+            write_chunk(pending.popleft().result())
+    fout.close()
+
+    if refine and residuals_after:
+        print_refinement_report(np.concatenate(residuals_before), np.concatenate(residuals_after), time.perf_counter() - start_time)
+    return num_frames
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Recompute kpts_3d of a session from saved 2D keypoint files and a calibration set")
+    parser.add_argument("--parameter_folder", type=str, required=True, help="Folder with the {camera}_intrinsics.dat and {camera}_extrinsics.dat files")
+    parser.add_argument("--camera_names", type=str, nargs='+', required=True, help="Camera names in the order of the 2D keypoint files, e.g. cam_0 cam_1 cam_2")
+    parser.add_argument("--kpts_2d", type=str, nargs='+', required=True, help="Per camera 2D keypoint files, e.g. kpts_cam0.dat kpts_cam1.dat kpts_cam2.dat")
+    parser.add_argument("--output", type=str, default="kpts_3d.dat", help="Output file of the 3D keypoints, .kpts writes the binary format")
+    parser.add_argument("--chunk_frames", type=int, default=5000, help="Frames per chunk sent to a worker process")
+    parser.add_argument("--processes", type=int, default=None, help="Number of worker processes, default is every core")
+    parser.add_argument("--refine", action="store_true", help="Refine the triangulated points by minimizing their reprojection error")
+    args = parser.parse_args()
+
+    rig = CameraRig.from_parameter_files(args.parameter_folder, args.camera_names)
+    num_frames = retriangulate_session(args.kpts_2d, rig, args.output, chunk_frames=args.chunk_frames, processes=args.processes,
+                                       refine=args.refine)
+    print(f'Triangulated {num_frames} frames into {args.output}')
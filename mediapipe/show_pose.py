@@ -1,25 +1,17 @@
 import numpy as np
 import matplotlib.pyplot as plt
+from keypoint_io import is_binary_keypoint_file, read_keypoints_binary, read_keypoints_text
 plt.style.use('seaborn')
 
 pose_keypoints = np.array([16, 14, 12, 11, 13, 15, 24, 23, 25, 26, 27, 28])
 
 def read_keypoints(filename):
-    fin = open(filename, 'r')
+    #binary keypoint files are memory mapped, only the frames that are accessed get read
+    if is_binary_keypoint_file(filename):
+        return read_keypoints_binary(filename)
 
-    kpts = []
-    while(True):
-        line = fin.readline()
-        if line == '': break
-
-        line = line.split()
-        line = [float(s) for s in line]
-
-        line = np.reshape(line, (len(pose_keypoints), -1))
-        kpts.append(line)
-
-    kpts = np.array(kpts)
-    return kpts
+    #text files are parsed in one vectorized pass
+    return read_keypoints_text(filename, num_keypoints=len(pose_keypoints))
 
 
 def visualize_3d(p3ds):
@@ -0,0 +1,180 @@
+import numpy as np
+from utils import triangulate_points, draw_keypoints
+from camera_workers import FrameBuffers, process_camera_frame
+
+
+class ViewScheduler:
+
+    """Decides per frame which cameras run Pose.process once the 3D pose is well constrained.
+
+    Until confidence_frames frames in a row were triangulated completely with a mean reprojection error
+    below max_reprojection_error pixels, every camera is detected. After that only num_active cameras are
+    detected per frame, rotating through the rig, plus a full refresh every refresh_every frames. The 3D pose
+    is predicted with constant velocity from the last two frames and reprojected into every camera: the
+    reprojections seed the regions of interest of cameras coming back to detection and stand in for the
+    observations of skipped cameras wherever less than two detected cameras saw a keypoint.
+
+    Example:
+        scheduler = ViewScheduler(rig, num_active=2)
+        for frames, keypoints, valid, p3ds in read_frames_scheduled(caps, poses, pose_keypoints, scheduler):
+            ...
+        scheduler.print_stats()
+    """
+
+    def __init__(self, rig, num_active=2, confidence_frames=5, max_reprojection_error=15.0, refresh_every=30):
+        self.rig = rig
+        self.num_cameras = len(rig)
+        self.num_active = min(max(num_active, 2), self.num_cameras)
+        self.confidence_frames = confidence_frames
+        self.max_reprojection_error = max_reprojection_error
+        self.refresh_every = refresh_every
+
+        self.frame_index = 0
+        self.detections = 0
+        self.confident_frames = 0
+        self.active = np.ones(self.num_cameras, dtype=bool)
+        # cameras detected now that were skipped in the previous frame
+        self.returning = np.zeros(self.num_cameras, dtype=bool)
+        self._history = []
+        self._offset = 0
+
+    @property
+    def confident(self):
+        return self.confident_frames >= self.confidence_frames
+
+    def select(self):
+
+        """(C,) mask of the cameras to detect in the next frame."""
+
+        previous = self.active
+        if not self.confident or self.frame_index % self.refresh_every == 0:
+            self.active = np.ones(self.num_cameras, dtype=bool)
+        else:
+            self.active = np.zeros(self.num_cameras, dtype=bool)
+            self.active[(self._offset + np.arange(self.num_active)) % self.num_cameras] = True
+            self._offset = (self._offset + self.num_active) % self.num_cameras
+
+        self.returning = self.active & ~previous
+        return self.active
+
+    def predict(self):
+
+        """Constant velocity prediction of the (K, 3) pose of the next frame, None without a confident pose."""
+
+        if not self.confident or not self._history:
+            return None
+        current = self._history[-1]
+        if len(self._history) < 2:
+            return current
+        previous = self._history[-2]
+        predicted = 2 * current - previous
+        # keypoints missing in the previous frame are held, missing in the current one stay missing
+        missing_previous = np.all(previous == -1, axis=-1)
+        predicted[missing_previous] = current[missing_previous]
+        predicted[np.all(current == -1, axis=-1)] = -1
+        return predicted
+
+    def predicted_observations(self):
+
+        """Reprojection of the predicted pose as ((C, K, 2) keypoints, (C, K) valid), None without a prediction."""
+
+        predicted = self.predict()
+        if predicted is None:
+            return None
+        keypoints = self.rig.reproject(predicted).transpose(1, 0, 2).astype(np.float32)
+        valid = np.broadcast_to(np.any(predicted != -1, axis=-1), keypoints.shape[:2]).copy()
+
+        # points outside of a camera's image are not observations of it
+        sizes = self.rig.image_sizes[:, np.newaxis, :]
+        inside = np.all(keypoints >= 0, axis=-1) & (np.all(keypoints < sizes, axis=-1) | np.all(sizes == 0, axis=-1))
+        return keypoints, valid & inside
+
+    def triangulate(self, keypoints, valid, predicted=None):
+
+        """Triangulate a frame whose skipped cameras have no detections.
+
+        Skipped cameras get the predicted keypoints, which are used as observations only for keypoints
+        seen by less than two detected cameras. Returns (keypoints, valid, p3ds) with the stand-ins filled in.
+        """
+
+        detected_valid = valid.copy()
+        if predicted is not None:
+            predicted_keypoints, predicted_valid = predicted
+            skipped = ~self.active
+            keypoints[skipped] = predicted_keypoints[skipped]
+            needed = valid.sum(axis=0) < 2
+            valid[skipped] = predicted_valid[skipped] & needed
+
+        p3ds = triangulate_points(self.rig, keypoints.transpose(1, 0, 2), valid.T)
+        self._update(p3ds, keypoints, detected_valid)
+
+        # counted here, once every camera's frame was read, so a selection hitting the end of the stream is not
+        self.frame_index += 1
+        self.detections += self.active.sum()
+        return keypoints, valid, p3ds
+
+    def _update(self, p3ds, keypoints, detected_valid):
+        # the pose is trusted while every keypoint triangulates and the detections agree with it
+        complete = not np.any(np.all(p3ds == -1, axis=-1))
+        error = np.inf
+        if complete and detected_valid.any():
+            reprojected = self.rig.reproject(p3ds).transpose(1, 0, 2)
+            error = np.mean(np.linalg.norm(reprojected - keypoints, axis=-1)[detected_valid])
+
+        if complete and error < self.max_reprojection_error:
+            self.confident_frames += 1
+        else:
+            self.confident_frames = 0
+
+        self._history = (self._history + [p3ds])[-2:]
+
+    def stats(self):
+        detections = int(self.detections)
+        return {'frames': self.frame_index, 'detections': detections,
+                'detections_per_frame': detections / max(self.frame_index, 1), 'cameras': self.num_cameras}
+
+    def print_stats(self):
+        stats = self.stats()
+        print(f"view scheduler: {stats['frames']} frames, {stats['detections']} detections, "
+              f"{stats['detections_per_frame']:.2f} of {stats['cameras']} cameras detected per frame")
+
+
+def read_frames_scheduled(caps, poses, pose_keypoints, scheduler, headless=False, inference_inputs=None):
+
+    """Yield (frames, keypoints, valid, p3ds) of every frame index, detecting only the cameras the scheduler selects.
+
+    Skipped cameras are only grabbed when running headless (their frame is None), otherwise they are decoded for
+    display with the predicted keypoints drawn on them.
+    """
+
+    buffers = [FrameBuffers() for _ in caps]
+    if inference_inputs is None:
+        inference_inputs = [None] * len(caps)
+
+    while True:
+        active = scheduler.select()
+        predicted = scheduler.predicted_observations()
+
+        frames = []
+        keypoints = np.full((len(caps), len(pose_keypoints), 2), -1, dtype=np.float32)
+        valid = np.zeros((len(caps), len(pose_keypoints)), dtype=bool)
+        for i, (cap, pose, inference_input) in enumerate(zip(caps, poses, inference_inputs)):
+            if active[i]:
+                if inference_input is not None and predicted is not None and scheduler.returning[i]:
+                    inference_input.seed(predicted[0][i], predicted[1][i])
+                ret, frame, frame_keypoints, frame_valid = process_camera_frame(cap, pose, pose_keypoints, headless, buffers[i], inference_input)
+                if ret:
+                    keypoints[i], valid[i] = frame_keypoints, frame_valid
+            elif headless:
+                # no decode needed, the camera only has to stay in step with the others
+                ret, frame = cap.grab(), None
+            else:
+                ret, frame, _ = buffers[i].read(cap, convert=False)
+                if ret and predicted is not None:
+                    draw_keypoints(frame, *[p[i] for p in predicted])
+            if not ret:
+                return  # End of video reached
+            frames.append(frame)
+
+        keypoints, valid, p3ds = scheduler.triangulate(keypoints, valid, predicted)
+        yield frames, keypoints, valid, p3ds
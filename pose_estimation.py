@@ -2,9 +2,15 @@ import cv2 as cv
 import mediapipe as mp
 import numpy as np
 import sys
-from utils import detect_keypoints, DLT, write_keypoints_to_disk, calibrate_camera, stereo_calibrate
+from utils import detect_keypoints, triangulate_points, write_keypoints_to_disk, calibrate_camera, stereo_calibrate, CameraRig
 
-def run_mp(input_stream1, input_stream2, input_stream3, P0, P1, P2):
+def run_mp(input_stream1, input_stream2, input_stream3, rig, headless=False, preview_every=0, sink=None):
+
+    # headless=True skips drawing and all GUI calls, e.g. for batch processing
+    # on servers. With preview_every=N a downscaled preview is still shown every N frames
+    # (frames 0, N, 2N, ...).
+    # With a sink (e.g. KeypointStreamWriter of mediapipe/keypoint_sink.py) every frame is streamed to it instead
+    # of being kept in memory, the returned arrays then only hold the frames still in the sink's ring buffer.
 
     #mediapipe related inits
     mp_drawing = mp.solutions.drawing_utils
@@ -12,7 +18,8 @@ def run_mp(input_stream1, input_stream2, input_stream3, P0, P1, P2):
     mp_pose = mp.solutions.pose
     
     # add here if you need more keypoints
-    pose_keypoints = [16, 14, 12, 11, 13, 15, 24, 23, 25, 26, 27, 28]
+    # index array into the 33 mediapipe landmarks, precomputed once
+    pose_keypoints = np.array([16, 14, 12, 11, 13, 15, 24, 23, 25, 26, 27, 28])
     
     # input video stream
     cap0 = cv.VideoCapture(input_stream1)
@@ -21,7 +28,7 @@ def run_mp(input_stream1, input_stream2, input_stream3, P0, P1, P2):
     caps = [cap0, cap1, cap2]
 
     # set camera resolution if using webcam to 1280x720. Any bigger will cause some lag for hand detection
-    for cap in caps:
+    for i, cap in enumerate(caps):
         # Get the width and height of the video capture
         width = int(cap.get(cv.CAP_PROP_FRAME_WIDTH))
         height = int(cap.get(cv.CAP_PROP_FRAME_HEIGHT))
@@ -29,6 +36,7 @@ def run_mp(input_stream1, input_stream2, input_stream3, P0, P1, P2):
         # Set the resolution of the video source to its native resolution
         cap.set(cv.CAP_PROP_FRAME_WIDTH, width)
         cap.set(cv.CAP_PROP_FRAME_HEIGHT, height)
+        rig.image_sizes[i] = (width, height)
 
     # create body keypoints detector objects.
     pose0 = mp_pose.Pose(min_detection_confidence=0.5, min_tracking_confidence=0.5)
@@ -38,107 +46,105 @@ def run_mp(input_stream1, input_stream2, input_stream3, P0, P1, P2):
     #pose4 = mp_pose.Pose(min_detection_confidence=0.5, min_tracking_confidence=0.5)
 
     # containers for detected keypoints for each camera. These are filled at each frame.
-    # This will run you into memory issue if you run the program without stop
+    # This will run you into memory issue if you run the program without stop, use a sink for long sessions
     kpts_cam0 = []
     kpts_cam1 = []
     kpts_cam2 = []
     #kpts_cam3 = []
     #kpts_cam4 = []
     kpts_3d = []
+    frame_index = 0
+
+    # capture and RGB conversion buffers, allocated on the first frame and reused afterwards
+    frame0, frame1, frame2 = None, None, None
+    rgb0, rgb1, rgb2 = None, None, None
     
     while True:
 
-        # read frames from stream
-        ret0, frame0 = cap0.read()
-        ret1, frame1 = cap1.read()
-        ret2, frame2 = cap2.read()
-        #ret3, frame3 = cap3.read()
-        #ret4, frame4 = cap4.read()
+        # read frames from stream into the preallocated capture buffers
+        ret0, frame0 = cap0.read(frame0)
+        ret1, frame1 = cap1.read(frame1)
+        ret2, frame2 = cap2.read(frame2)
+        #ret3, frame3 = cap3.read(frame3)
+        #ret4, frame4 = cap4.read(frame4)
 
         if not ret0 or not ret1 or not ret2: 
             break
 
-        # the BGR image to RGB.
-        frame0 = cv.cvtColor(frame0, cv.COLOR_BGR2RGB)
-        frame1 = cv.cvtColor(frame1, cv.COLOR_BGR2RGB)
-        frame2 = cv.cvtColor(frame2, cv.COLOR_BGR2RGB)
-        #frame3 = cv.cvtColor(frame3, cv.COLOR_BGR2RGB)
-        #frame4 = cv.cvtColor(frame4, cv.COLOR_BGR2RGB)
+        # the BGR image to RGB, converted into the preallocated buffers.
+        rgb0 = cv.cvtColor(frame0, cv.COLOR_BGR2RGB, dst=rgb0)
+        rgb1 = cv.cvtColor(frame1, cv.COLOR_BGR2RGB, dst=rgb1)
+        rgb2 = cv.cvtColor(frame2, cv.COLOR_BGR2RGB, dst=rgb2)
+        #rgb3 = cv.cvtColor(frame3, cv.COLOR_BGR2RGB, dst=rgb3)
+        #rgb4 = cv.cvtColor(frame4, cv.COLOR_BGR2RGB, dst=rgb4)
 
 
         # To improve performance, optionally mark the image as not writeable to
         # pass by reference.
-        frame0.flags.writeable = False
-        frame1.flags.writeable = False
-        frame2.flags.writeable = False
-        #frame3.flags.writeable = False
-        #frame4.flags.writeable = False
+        rgb0.flags.writeable = False
+        rgb1.flags.writeable = False
+        rgb2.flags.writeable = False
+        #rgb3.flags.writeable = False
+        #rgb4.flags.writeable = False
         
-        results0 = pose0.process(frame0)
-        results1 = pose1.process(frame1)
-        results2 = pose2.process(frame2)
-        #results3 = pose3.process(frame3)
-        #results4 = pose4.process(frame4)
+        results0 = pose0.process(rgb0)
+        results1 = pose1.process(rgb1)
+        results2 = pose2.process(rgb2)
+        #results3 = pose3.process(rgb3)
+        #results4 = pose4.process(rgb4)
 
         #reverse changes
-        frame0.flags.writeable = True
-        frame1.flags.writeable = True
-        frame2.flags.writeable = True
-        #frame3.flags.writeable = True
-        #frame4.flags.writeable = True
-        frame0 = cv.cvtColor(frame0, cv.COLOR_RGB2BGR)
-        frame1 = cv.cvtColor(frame1, cv.COLOR_RGB2BGR)
-        frame2 = cv.cvtColor(frame2, cv.COLOR_RGB2BGR)
-        #frame3 = cv.cvtColor(frame3, cv.COLOR_RGB2BGR)
-        #frame4 = cv.cvtColor(frame4, cv.COLOR_RGB2BGR)
+        rgb0.flags.writeable = True
+        rgb1.flags.writeable = True
+        rgb2.flags.writeable = True
+        #rgb3.flags.writeable = True
+        #rgb4.flags.writeable = True
 
+        #keypoints are drawn on the BGR capture buffers, so there is no conversion back
 
-        #detect keypoints and keep keypoints of the frame in memory
-        frame0_keypoints = detect_keypoints(frame0, results0, pose_keypoints)
-        kpts_cam0.append(frame0_keypoints)     
-        
-        frame1_keypoints = detect_keypoints(frame1, results1, pose_keypoints)
-        kpts_cam1.append(frame1_keypoints)
-
-        frame2_keypoints = detect_keypoints(frame2, results2, pose_keypoints)
-        kpts_cam2.append(frame2_keypoints)
 
-        #frame3_keypoints = detect_keypoints(frame3, results3, pose_keypoints)
+        #detect keypoints and keep keypoints of the frame in memory
+        frame0_keypoints, frame0_visibility, frame0_valid = detect_keypoints(frame0, results0, pose_keypoints, draw=not headless)
+        frame1_keypoints, frame1_visibility, frame1_valid = detect_keypoints(frame1, results1, pose_keypoints, draw=not headless)
+        frame2_keypoints, frame2_visibility, frame2_valid = detect_keypoints(frame2, results2, pose_keypoints, draw=not headless)
+        if sink is None:
+            kpts_cam0.append(frame0_keypoints)
+            kpts_cam1.append(frame1_keypoints)
+            kpts_cam2.append(frame2_keypoints)
+
+        #frame3_keypoints, frame3_visibility, frame3_valid = detect_keypoints(frame3, results3, pose_keypoints)
         #kpts_cam3.append(frame3_keypoints)
 
-        #frame4_keypoints = detect_keypoints(frame4, results4, pose_keypoints)
+        #frame4_keypoints, frame4_visibility, frame4_valid = detect_keypoints(frame4, results4, pose_keypoints)
         #kpts_cam4.append(frame4_keypoints)
 
 
-        #calculate 3d position
-        frame_p3ds = []
-        for uv1, uv2, uv3 in zip(frame0_keypoints, frame1_keypoints, frame2_keypoints):
-            #if uv1[0] == -1 or uv2[0] == -1 or uv3[0] == -1 or uv4[0] == -1 or uv5[0] == -1:
-                #_p3d = [-1, -1, -1]
-            #else:
-            #_p3d = DLT(P0, P1, P2, P3, P4, uv1, uv2, uv3, uv4, uv5) #calculate 3d position of keypoint
-            #frame_p3ds.append(_p3d)
-            #if not (uv1 != -1 or uv2 != -1 or uv3 != -1 or uv4 != -1):
-                #_p3d = DLT(P0, P1, P2, P3, P4, uv1, uv2, uv3, uv4, uv5) #calculate 3d position of keypoint
-
-            if (uv1 == -1 and uv2 == -1) or \
-            (uv1 == -1 and uv3 == -1) or \
-            (uv2 == -1 and uv3 == -1) :
-                _p3d = [-1, -1, -1]
-
-            else :
-                _p3d = DLT(P0, P1, P2, uv1, uv2, uv3)
-            
-            frame_p3ds.append(_p3d)
-
-
+        #calculate 3d position of all keypoints in one batched call, (K, C, 2) -> (K, 3)
+        uv_coords = np.stack([frame0_keypoints, frame1_keypoints, frame2_keypoints], axis=1)
+        visibility = np.stack([frame0_valid, frame1_valid, frame2_valid], axis=1)
+        frame_p3ds = triangulate_points(rig, uv_coords, visibility)
 
         '''
         This contains the 3d position of each keypoint in current frame.
         For real time application, this is what you want.
         '''
         frame_p3ds = np.array(frame_p3ds).reshape((12, 3))
-        kpts_3d.append(frame_p3ds)
+        if sink is None:
+            kpts_3d.append(frame_p3ds)
+        else:
+            sink.append(np.stack([frame0_keypoints, frame1_keypoints, frame2_keypoints]), frame_p3ds)
+
+        #index of the current frame, counted from 0 like in mediapipe/pose_updated.py
+        show_preview = preview_every and frame_index % preview_every == 0
+        frame_index += 1
+
+        if headless:
+            #cheap preview of the captured frames every preview_every frames, starting with the first one
+            if show_preview:
+                for name, frame in (('cam0', frame0), ('cam1', frame1), ('cam2', frame2)):
+                    cv.imshow(name, cv.resize(frame, None, fx=0.25, fy=0.25, interpolation=cv.INTER_NEAREST))
+                if cv.waitKey(1) & 0xFF == 27: break
+            continue
 
         cv.imshow('cam0', frame0)
         cv.imshow('cam1', frame1)
@@ -150,10 +156,15 @@ def run_mp(input_stream1, input_stream2, input_stream3, P0, P1, P2):
         if k & 0xFF == 27: break #27 is ESC key.
 
 
-    cv.destroyAllWindows()
+    if not headless or preview_every:
+        cv.destroyAllWindows()
     for cap in caps:
         cap.release()
 
+    if sink is not None:
+        sink.flush()
+        kpts_2d = sink.latest_2d(sink.frame_count)
+        return kpts_2d[:, 0], kpts_2d[:, 1], kpts_2d[:, 2], sink.latest_3d(sink.frame_count)
 
     return np.array(kpts_cam0), np.array(kpts_cam1), np.array(kpts_cam2), np.array(kpts_3d)
 
@@ -203,7 +214,16 @@ if __name__ == '__main__':
     #RT5 = np.concatenate([R_pair_4, T_pair_4], axis = -1)
     #P4 = mtx5 @ RT5 #projection matrix for C5
 
-    kpts_cam0, kpts_cam1, kpts_cam2, kpts_3d = run_mp(input_stream1, input_stream2, input_stream3, P0, P1, P2)
+    #projection data of all cameras, built once
+    rig = CameraRig.from_projection_matrices([P0, P1, P2], camera_names=['cam0', 'cam1', 'cam3'])
+
+    kpts_cam0, kpts_cam1, kpts_cam2, kpts_3d = run_mp(input_stream1, input_stream2, input_stream3, rig)
+
+    #for long sessions, stream the keypoints to disk in constant memory instead
+    #sys.path.append('mediapipe')
+    #from keypoint_sink import KeypointStreamWriter
+    #with KeypointStreamWriter('.', num_cameras=3, num_keypoints=12) as sink:
+    #    run_mp(input_stream1, input_stream2, input_stream3, rig, headless=True, sink=sink)
 
     #this will create keypoints file in current working folder
     write_keypoints_to_disk('kpts_cam0.dat', kpts_cam0)
@@ -36,23 +36,156 @@ def DLT(P1, P2, P3, point1, point2, point3):
     # Return the inhomogeneous solution
     return Vh[3,0:3]/Vh[3,3]
 
-def detect_keypoints(frame, results, pose_keypoints):
-    frame_keypoints = []
+
+def triangulate_points(projection_matrices, points, visibility=None):
+
+    """Triangulate every keypoint of every frame with one batched DLT solve.
+
+    Args:
+        projection_matrices (CameraRig or numpy.ndarray): camera rig, or (C, 3, 4) stack of camera projection matrices.
+        points (numpy.ndarray): (F, K, C, 2) pixel coordinates, or (K, C, 2) for a single frame.
+        visibility (numpy.ndarray, optional): boolean mask with the shape of points[..., 0].
+            If omitted, observations equal to [-1, -1] are treated as missing.
+
+    Returns:
+        numpy.ndarray: (F, K, 3) triangulated points ((K, 3) for a single frame). Keypoints
+        seen by less than two cameras are filled with -1.
+    """
+
+    if isinstance(projection_matrices, CameraRig):
+        P0, P1, P2 = projection_matrices.rows
+    else:
+        P = np.asarray(projection_matrices, dtype=np.float64)
+        P0, P1, P2 = P[:, 0, :], P[:, 1, :], P[:, 2, :]
+
+    points = np.asarray(points, dtype=np.float64)
+    single_frame = points.ndim == 3
+    if single_frame:
+        points = points[np.newaxis]
+
+    if visibility is None:
+        visibility = np.any(points != -1, axis=-1)
+    else:
+        visibility = np.broadcast_to(np.asarray(visibility, dtype=bool).reshape(points.shape[:-1]), points.shape[:-1])
+
+    # two DLT rows per observation, (F, K, C, 2, 4). Missing observations are zeroed out
+    x = points[..., 0, np.newaxis]
+    y = points[..., 1, np.newaxis]
+    A = np.empty(points.shape[:-1] + (2, 4))
+    A[..., 0, :] = y * P2 - P1
+    A[..., 1, :] = P0 - x * P2
+    A *= visibility[..., np.newaxis, np.newaxis]
+
+    # B = A.T @ A for every keypoint, then the eigenvector of the smallest eigenvalue
+    # is the homogeneous solution (same as the last right singular vector of B)
+    B = np.einsum('...cri,...crj->...ij', A, A)
+    _, eigenvectors = np.linalg.eigh(B)
+    X = eigenvectors[..., :, 0]
+
+    #we need at least two views to do triangulation
+    valid = (visibility.sum(axis=-1) >= 2) & (X[..., 3] != 0)
+    p3ds = np.full(points.shape[:2] + (3,), -1.0)
+    p3ds[valid] = X[valid, :3] / X[valid, 3:]
+
+    if single_frame:
+        return p3ds[0]
+    return p3ds
+
+
+class CameraRig:
+
+    """Projection data of a calibrated multi camera setup, precomputed once.
+
+    Holds the (C, 3, 4) projection stack, its rows pre-split for DLT, the camera names and
+    the image size of each camera. triangulate_points and the reprojection code take this
+    object directly so nothing is rebuilt per frame.
+    """
+
+    def __init__(self, projection_matrices, camera_names=None, image_sizes=None):
+
+        #contiguous (C, 3, 4) projection stack, built once
+        self.projection_matrices = np.ascontiguousarray(projection_matrices, dtype=np.float64)
+        num_cameras = len(self.projection_matrices)
+
+        #rows of every projection matrix pre-split for DLT, each one (C, 4)
+        self.rows = tuple(np.ascontiguousarray(self.projection_matrices[:, i, :]) for i in range(3))
+
+        if camera_names is None:
+            camera_names = [f'cam{i}' for i in range(num_cameras)]
+        self.camera_names = list(camera_names)
+
+        #(width, height) of each camera, 0 if unknown
+        if image_sizes is None:
+            image_sizes = np.zeros((num_cameras, 2), dtype=int)
+        self.image_sizes = np.array(image_sizes, dtype=int).reshape((num_cameras, 2))
+
+    def __len__(self):
+        return len(self.projection_matrices)
+
+    @classmethod
+    def from_projection_matrices(cls, projection_matrices, camera_names=None, image_sizes=None):
+        return cls(np.stack(projection_matrices), camera_names, image_sizes)
+
+    def triangulate(self, points, visibility=None):
+        return triangulate_points(self, points, visibility)
+
+    def reproject(self, points_3d):
+
+        """Project (..., 3) world points into every camera, returns (..., C, 2) pixel coordinates."""
+
+        points_3d = np.asarray(points_3d, dtype=np.float64)
+        P0, P1, P2 = self.rows
+        Xh = np.concatenate([points_3d, np.ones(points_3d.shape[:-1] + (1,))], axis=-1)
+        w = Xh @ P2.T
+        uv = np.stack([Xh @ P0.T / w, Xh @ P1.T / w], axis=-1)
+
+        #keep the -1 sentinel for points that could not be triangulated
+        uv[np.all(points_3d == -1, axis=-1)] = -1
+        return uv
+
+def detect_keypoints(frame, results, pose_keypoints, draw=True, out=None):
+
+    """Gather the selected mediapipe landmarks of a frame into pixel coordinate arrays.
+
+    Args:
+        frame (numpy.ndarray): the frame the landmarks were detected on, keypoints are drawn on it if draw is True.
+        results: output of mp_pose.Pose.process.
+        pose_keypoints (numpy.ndarray): precomputed index array of the landmarks to keep, K entries.
+        draw (bool, optional): draw the keypoints into the frame. Default is True.
+        out (numpy.ndarray, optional): preallocated (K, 3) float32 array receiving x, y and visibility.
+
+    Returns:
+        tuple: (keypoints, visibility, valid). keypoints is a (K, 2) float32 view with sub-pixel coordinates,
+        visibility the (K,) mediapipe visibility scores and valid a (K,) boolean mask. Keypoints of frames
+        without detection are not valid and keep [-1, -1] so they are written to disk as before.
+    """
+
+    if out is None:
+        out = np.empty((len(pose_keypoints), 3), dtype=np.float32)
+
     if results.pose_landmarks:
-        for i, landmark in enumerate(results.pose_landmarks.landmark):
-            if i not in pose_keypoints: continue #only save keypoints that are indicated in pose_keypoints
-            pxl_x = landmark.x * frame.shape[1]
-            pxl_y = landmark.y * frame.shape[0]
-            pxl_x = int(round(pxl_x))
-            pxl_y = int(round(pxl_y))
-            cv.circle(frame,(pxl_x, pxl_y), 3, (0,0,255), -1) #add keypoint detection points into figure
-            kpts = [pxl_x, pxl_y]
-            frame_keypoints.append(kpts)
+        landmarks = results.pose_landmarks.landmark
+        for j, i in enumerate(pose_keypoints):
+            landmark = landmarks[i]
+            out[j, 0] = landmark.x
+            out[j, 1] = landmark.y
+            out[j, 2] = landmark.visibility
+
+        #normalized coordinates to pixels
+        out[:, 0] *= frame.shape[1]
+        out[:, 1] *= frame.shape[0]
+        valid = np.ones(len(pose_keypoints), dtype=bool)
+
+        if draw:
+            for pxl_x, pxl_y in np.rint(out[:, :2]).astype(int):
+                cv.circle(frame,(pxl_x, pxl_y), 3, (0,0,255), -1) #add keypoint detection points into figure
     else:
         #if no keypoints are found, simply fill the frame data with [-1,-1] for each kpt
-        frame_keypoints = [[-1, -1]]*len(pose_keypoints)
+        out[:, :2] = -1
+        out[:, 2] = 0
+        valid = np.zeros(len(pose_keypoints), dtype=bool)
 
-    return frame_keypoints
+    return out[:, :2], out[:, 2], valid
 
 
 def calibrate_camera(images_folder, rows=9, columns=6, world_scaling=1.0):